@@ -5,6 +5,7 @@ import 'package:flutter/rendering.dart';
 
 import 'package:flutter/material.dart';
 import 'package:http/http.dart' as http;
+import 'package:crypto/crypto.dart';
 import 'package:flutter_dotenv/flutter_dotenv.dart'; // import dotenv
 import 'package:path_provider/path_provider.dart';
 import 'package:flutter_tts/flutter_tts.dart';
@@ -36,22 +37,50 @@ class _ImagePreviewPageState extends State<ImagePreviewPage> {
   final GlobalKey repaintKey = GlobalKey();
 
   // ---------------- PROCESS IMAGE ----------------
-  Future<void> processImage() async {
-    setState(() => loading = true);
-
-    try {
-      final url = "${dotenv.env['API_URL']}/daltonize";
-      debugPrint("🚀 SENDING TO: $url");
-
+  // The server caches results by the image's SHA-256, so each request first
+  // sends only the hash and uploads the file if that result isn't cached
+  late final Future<String> imageDigest = widget.imageFile
+      .readAsBytes()
+      .then((bytes) => sha256.convert(bytes).toString());
+
+  // Previews use the server's fast default (JPEG); saving asks for lossless PNG
+  Future<Uint8List> requestCorrected({String? output}) async {
+    final url = "${dotenv.env['API_URL']}/daltonize";
+    debugPrint("🚀 SENDING TO: $url");
+
+    Future<http.StreamedResponse> send({required bool upload}) async {
       final request = http.MultipartRequest('POST', Uri.parse(url));
 
       request.fields['defect'] = selectedDefect;
-      request.files.add(
-        await http.MultipartFile.fromPath('image', widget.imageFile.path),
-      );
+      if (output != null) request.fields['output'] = output;
+      if (upload) {
+        request.files.add(
+          await http.MultipartFile.fromPath('image', widget.imageFile.path),
+        );
+      } else {
+        request.fields['image_sha256'] = await imageDigest;
+      }
+      return request.send();
+    }
 
-      final response = await request.send();
-      final bytes = await response.stream.toBytes();
+    var response = await send(upload: false);
+    if (response.statusCode == 404) {
+      await response.stream.drain();
+      response = await send(upload: true);
+    }
+
+    final body = await response.stream.toBytes();
+    if (response.statusCode != 200) {
+      throw Exception("Server error ${response.statusCode}");
+    }
+    return body;
+  }
+
+  Future<void> processImage() async {
+    setState(() => loading = true);
+
+    try {
+      final bytes = await requestCorrected();
 
       if (mounted) {
         setState(() {
@@ -86,7 +115,7 @@ class _ImagePreviewPageState extends State<ImagePreviewPage> {
           "${saveDir.path}/enhanced_${DateTime.now().millisecondsSinceEpoch}.png";
 
       final file = File(filePath);
-      await file.writeAsBytes(processedImage!);
+      await file.writeAsBytes(await requestCorrected(output: "png"));
 
       if (!mounted) return;
       ScaffoldMessenger.of(
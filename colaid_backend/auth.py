@@ -0,0 +1,149 @@
+from flask import Blueprint, request, jsonify
+import os
+import metrics
+from flask_login import LoginManager, login_user, logout_user, login_required, current_user
+from pymongo.errors import DuplicateKeyError
+from bson import ObjectId
+from models import User
+from cache import TTLCache
+from database import get_db
+
+bp = Blueprint('auth', __name__)
+
+# Signs the session cookie; shared with auth_async.py so either server
+# accepts the other's sessions
+SECRET_KEY = os.getenv('SECRET_KEY', 'fallback_secret')
+
+# Seconds a loaded user is trusted before Mongo is asked again. Invalidation
+# is per process, so other workers may see a changed user for up to this long.
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', 60))
+user_cache = TTLCache(USER_CACHE_TTL)
+
+login_manager = LoginManager()
+login_manager.login_view = 'auth.login'
+
+@login_manager.user_loader
+def load_user(user_id):
+    try:
+        user_data = user_cache.get(user_id)
+        if user_data is None:
+            # Sessions never need the password hash, so it isn't cached
+            with metrics.stage("mongo_load_user"):
+                user_data = get_db().users.find_one({'_id': ObjectId(user_id)},
+                                                    {'password_hash': 0})
+            if user_data:
+                user_cache.put(user_id, user_data)
+        if user_data:
+            return User(user_data)
+    except:
+        pass
+    return None
+
+@bp.route('/register', methods=['POST'])
+def register():
+    data = request.get_json()
+    username = data.get('username')
+    password = data.get('password')
+
+    if not username or not password:
+        return jsonify({"error": "Missing username or password"}), 400
+
+    # Check if user exists
+    with metrics.stage("mongo_find"):
+        existing = get_db().users.find_one({'username': username})
+    if existing:
+        return jsonify({"error": "Username already exists"}), 400
+
+    # Create new user
+    new_user = User({'username': username})
+    new_user.set_password(password)
+    
+    try:
+        with metrics.stage("mongo_insert"):
+            get_db().users.insert_one(new_user.to_dict())
+    except DuplicateKeyError:
+        # Lost a race with a concurrent registration
+        return jsonify({"error": "Username already exists"}), 400
+
+    return jsonify({"message": "User registered successfully"}), 201
+
+@bp.route('/login', methods=['POST'])
+def login():
+    data = request.get_json()
+    username = data.get('username')
+    password = data.get('password')
+
+    with metrics.stage("mongo_find"):
+        user_data = get_db().users.find_one({'username': username})
+
+    if user_data:
+        user = User(user_data)
+        if user.check_password(password):
+            login_user(user)
+            return jsonify({"message": "Login successful"}), 200
+    
+    return jsonify({"error": "Invalid credentials"}), 401
+
+@bp.route('/logout', methods=['POST'])
+@login_required
+def logout():
+    logout_user()
+    return jsonify({"message": "Logged out successfully"}), 200
+
+@bp.route('/reset-password', methods=['POST'])
+@login_required
+def reset_password():
+    data = request.get_json()
+    new_password = data.get('new_password')
+
+    if not new_password or len(new_password) < 6:
+        return jsonify({"error": "Password must be at least 6 characters"}), 400
+
+    # Update password in MongoDB
+    user = User({'_id': ObjectId(current_user.get_id())})
+    user.set_password(new_password)
+    
+    with metrics.stage("mongo_update"):
+        get_db().users.update_one(
+            {'_id': ObjectId(current_user.get_id())},
+            {'$set': {'password_hash': user.password_hash}}
+        )
+    user_cache.invalidate(current_user.get_id())
+
+    return jsonify({"message": "Password updated successfully"}), 200
+
+@bp.route('/delete-account', methods=['POST'])
+@login_required
+def delete_account():
+    try:
+        with metrics.stage("mongo_delete"):
+            get_db().users.delete_one({'_id': ObjectId(current_user.get_id())})
+        user_cache.invalidate(current_user.get_id())
+        logout_user()
+        return jsonify({"message": "Account deleted successfully"}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@bp.route('/guest-login', methods=['POST'])
+def guest_login():
+    with metrics.stage("mongo_find"):
+        guest_data = get_db().users.find_one({'username': 'Guest'})
+    
+    if not guest_data:
+        # Create a Guest user with a random high-entropy password
+        import secrets
+        guest_user = User({'username': 'Guest'})
+        guest_user.set_password(secrets.token_hex(16))
+        try:
+            with metrics.stage("mongo_insert"):
+                result = get_db().users.insert_one(guest_user.to_dict())
+            query = {'_id': result.inserted_id}
+        except DuplicateKeyError:
+            # Another request created the Guest user first
+            query = {'username': 'Guest'}
+        with metrics.stage("mongo_find"):
+            guest_data = get_db().users.find_one(query)
+    
+    guest_user = User(guest_data)
+    login_user(guest_user)
+    return jsonify({"message": "Logged in as Guest", "username": "Guest"}), 200
@@ -0,0 +1,403 @@
+"""Asyncio front end for the account routes.
+
+Serves /register, /login, /logout, /reset-password, /delete-account and
+/guest-login as an ASGI app on pymongo's asyncio driver, so a request
+waiting on MongoDB holds a coroutine instead of a whole worker. Password
+hashing still runs on the hash pool in models.py.
+
+Sessions are Flask's signed session cookie holding Flask-Login's keys, so
+a client logged in here is logged in on the Flask app and vice versa, as
+long as both share SECRET_KEY. Route the account paths to this server and
+everything else to the Flask app:
+
+    uvicorn auth_async:app --port 5001 --workers 2
+"""
+import time
+
+_import_started = time.perf_counter()
+
+import functools
+import io
+import json
+import os
+import secrets
+from hashlib import sha512
+from urllib.parse import urlencode
+
+from dotenv import load_dotenv
+
+# Before the app modules are imported, so their settings see .env
+load_dotenv()
+
+from a2wsgi.wsgi import build_environ
+from bson import ObjectId
+from flask import Flask, request as flask_request
+from flask_login import COOKIE_NAME, make_next_param
+from flask_login.utils import _create_identifier
+from pymongo.errors import DuplicateKeyError
+from werkzeug.exceptions import HTTPException, InternalServerError, RequestEntityTooLarge
+from werkzeug.routing import Map, Rule
+from werkzeug.utils import redirect
+from werkzeug.wrappers import Request, Response
+
+import metrics
+from auth import SECRET_KEY, login_manager, user_cache
+from database import get_async_db, get_async_client
+from models import User
+
+# Largest request body accepted; account requests are small JSON objects
+AUTH_MAX_BODY_BYTES = int(os.getenv('AUTH_MAX_BODY_BYTES', 64 * 1024))
+
+# Never serves requests: it carries the session cookie settings, so
+# cookies are signed, named and scoped exactly as the Flask app's are
+_flask_app = Flask("app")
+_flask_app.config['SECRET_KEY'] = SECRET_KEY
+_sessions = _flask_app.session_interface
+
+
+class AccountRequest(Request):
+    """Werkzeug request with the Flask session and per-stage timings."""
+
+    max_content_length = AUTH_MAX_BODY_BYTES
+
+    def __init__(self, environ):
+        super().__init__(environ)
+        self.session = _sessions.open_session(_flask_app, self)
+        self.timings = {}
+
+
+def jsonify(payload, status=200):
+    """flask.jsonify, without needing an app context."""
+    response = _flask_app.json.response(payload)
+    response.status_code = status
+    return response
+
+
+# --- Flask-Login semantics (session keys only; the app never sets remember-me) ---
+def _session_identifier(request):
+    """Flask-Login's session identifier: a hash of client address and User-Agent."""
+    address = request.headers.get("X-Forwarded-For", request.remote_addr)
+    if address is not None:
+        address = address.encode("utf-8").split(b",")[0].strip()
+    user_agent = request.headers.get("User-Agent")
+    if user_agent is not None:
+        user_agent = user_agent.encode("utf-8")
+    return sha512(f"{address}|{user_agent}".encode("utf8")).hexdigest()
+
+
+def _check_session_identifier():
+    """Fail at startup if Flask-Login now derives the identifier differently.
+
+    A mismatch would make every session look like it came from another
+    client, silently breaking sessions shared with the Flask app.
+    """
+    cases = [{"headers": {"User-Agent": "colaid-check"}},
+             {"headers": {"X-Forwarded-For": "203.0.113.7, 10.0.0.1"}},
+             {"environ_base": {"REMOTE_ADDR": "10.0.0.1"}}]
+    for case in cases:
+        with _flask_app.test_request_context(**case):
+            if _session_identifier(flask_request) != _create_identifier():
+                raise RuntimeError("flask_login's session identifier changed; "
+                                   "update auth_async._session_identifier")
+
+
+_check_session_identifier()
+
+
+def login_user(request, user):
+    request.session["_user_id"] = user.get_id()
+    request.session["_fresh"] = True
+    request.session["_id"] = _session_identifier(request)
+
+
+def logout_user(request):
+    for key in ("_user_id", "_fresh", "_id"):
+        if key in request.session:
+            request.session.pop(key)
+    if COOKIE_NAME in request.cookies:
+        request.session["_remember"] = "clear"
+
+
+async def load_user(request):
+    """The session's User, or None. Mirrors auth.load_user, sharing its cache."""
+    session = request.session
+    # "basic" session protection: a session used from another client stays
+    # logged in but is no longer fresh
+    if session and session.get("_id") != _session_identifier(request):
+        if session.get("_fresh") is not False:
+            session["_fresh"] = False
+
+    user_id = session.get("_user_id")
+    if user_id is None:
+        return None
+    try:
+        user_data = user_cache.get(user_id)
+        if user_data is None:
+            db = await get_async_db()
+            with metrics.stage("mongo_load_user", request.timings):
+                user_data = await db.users.find_one({'_id': ObjectId(user_id)},
+                                                    {'password_hash': 0})
+            if user_data:
+                user_cache.put(user_id, user_data)
+        if user_data:
+            return User(user_data)
+    except Exception:
+        pass
+    return None
+
+
+def unauthorized(request):
+    """What Flask-Login answers with a login_view: flash and redirect to it."""
+    if login_manager.login_message:
+        flashes = request.session.get("_flashes", [])
+        flashes.append((login_manager.login_message_category, login_manager.login_message))
+        request.session["_flashes"] = flashes
+    login_url = request.root_path + "/login"
+    return redirect(login_url + "?" + urlencode({"next": make_next_param(login_url, request.url)}))
+
+
+def login_required(handler):
+    """Like flask_login.login_required; the handler also gets the user."""
+
+    @functools.wraps(handler)
+    async def wrapper(request):
+        user = await load_user(request)
+        if user is None:
+            return unauthorized(request)
+        return await handler(request, user)
+    return wrapper
+
+
+# --- Routes (responses match auth.py) ---
+async def register(request):
+    data = request.get_json()
+    username = data.get('username')
+    password = data.get('password')
+
+    if not username or not password:
+        return jsonify({"error": "Missing username or password"}, 400)
+
+    users = (await get_async_db()).users
+    with metrics.stage("mongo_find", request.timings):
+        existing = await users.find_one({'username': username})
+    if existing:
+        return jsonify({"error": "Username already exists"}, 400)
+
+    new_user = User({'username': username})
+    await new_user.set_password_async(password)
+
+    try:
+        with metrics.stage("mongo_insert", request.timings):
+            await users.insert_one(new_user.to_dict())
+    except DuplicateKeyError:
+        return jsonify({"error": "Username already exists"}, 400)
+
+    return jsonify({"message": "User registered successfully"}, 201)
+
+
+async def login(request):
+    data = request.get_json()
+    username = data.get('username')
+    password = data.get('password')
+
+    users = (await get_async_db()).users
+    with metrics.stage("mongo_find", request.timings):
+        user_data = await users.find_one({'username': username})
+
+    if user_data:
+        user = User(user_data)
+        if await user.check_password_async(password):
+            login_user(request, user)
+            return jsonify({"message": "Login successful"}, 200)
+
+    return jsonify({"error": "Invalid credentials"}, 401)
+
+
+@login_required
+async def logout(request, user):
+    logout_user(request)
+    return jsonify({"message": "Logged out successfully"}, 200)
+
+
+@login_required
+async def reset_password(request, user):
+    data = request.get_json()
+    new_password = data.get('new_password')
+
+    if not new_password or len(new_password) < 6:
+        return jsonify({"error": "Password must be at least 6 characters"}, 400)
+
+    updated = User({'_id': ObjectId(user.get_id())})
+    await updated.set_password_async(new_password)
+
+    users = (await get_async_db()).users
+    with metrics.stage("mongo_update", request.timings):
+        await users.update_one(
+            {'_id': ObjectId(user.get_id())},
+            {'$set': {'password_hash': updated.password_hash}}
+        )
+    user_cache.invalidate(user.get_id())
+
+    return jsonify({"message": "Password updated successfully"}, 200)
+
+
+@login_required
+async def delete_account(request, user):
+    try:
+        users = (await get_async_db()).users
+        with metrics.stage("mongo_delete", request.timings):
+            await users.delete_one({'_id': ObjectId(user.get_id())})
+        user_cache.invalidate(user.get_id())
+        logout_user(request)
+        return jsonify({"message": "Account deleted successfully"}, 200)
+    except Exception as e:
+        return jsonify({"error": str(e)}, 500)
+
+
+async def guest_login(request):
+    users = (await get_async_db()).users
+    with metrics.stage("mongo_find", request.timings):
+        guest_data = await users.find_one({'username': 'Guest'})
+
+    if not guest_data:
+        # Create a Guest user with a random high-entropy password
+        guest_user = User({'username': 'Guest'})
+        await guest_user.set_password_async(secrets.token_hex(16))
+        try:
+            with metrics.stage("mongo_insert", request.timings):
+                result = await users.insert_one(guest_user.to_dict())
+            query = {'_id': result.inserted_id}
+        except DuplicateKeyError:
+            # Another request created the Guest user first
+            query = {'username': 'Guest'}
+        with metrics.stage("mongo_find", request.timings):
+            guest_data = await users.find_one(query)
+
+    login_user(request, User(guest_data))
+    return jsonify({"message": "Logged in as Guest", "username": "Guest"}, 200)
+
+
+async def healthz(request):
+    # Liveness only: must answer even while MongoDB is unreachable
+    return jsonify({"status": "ok", "pid": os.getpid(),
+                    "startup_ms": round(STARTUP_SECONDS * 1000, 1)})
+
+
+async def metrics_endpoint(request):
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+url_map = Map([
+    Rule("/register", methods=["POST"], endpoint=register),
+    Rule("/login", methods=["POST"], endpoint=login),
+    Rule("/logout", methods=["POST"], endpoint=logout),
+    Rule("/reset-password", methods=["POST"], endpoint=reset_password),
+    Rule("/delete-account", methods=["POST"], endpoint=delete_account),
+    Rule("/guest-login", methods=["POST"], endpoint=guest_login),
+    Rule("/healthz", methods=["GET"], endpoint=healthz),
+    Rule("/metrics", methods=["GET"], endpoint=metrics_endpoint),
+])
+
+
+# --- ASGI plumbing ---
+async def _read_body(receive):
+    """The whole request body, or None if the client disconnected."""
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > AUTH_MAX_BODY_BYTES:
+            raise RequestEntityTooLarge()
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+def _environ(scope, body):
+    """WSGI environ for an ASGI HTTP scope, so werkzeug can parse the request."""
+    environ = build_environ(scope, io.BytesIO(body))
+    # The body is already read whole, chunked or not
+    environ["CONTENT_LENGTH"] = str(len(body))
+    return environ
+
+
+async def _dispatch(scope, receive):
+    """Run one request. Returns (route, request or None, response)."""
+    route, request = "unmatched", None
+    try:
+        body = await _read_body(receive)
+        if body is None:
+            return route, None, None
+        request = AccountRequest(_environ(scope, body))
+        rule, _ = url_map.bind_to_environ(request.environ).match(return_rule=True)
+        route = rule.rule
+        metrics.REQUESTS_IN_FLIGHT.inc(route=route)
+        try:
+            return route, request, await rule.endpoint(request)
+        finally:
+            metrics.REQUESTS_IN_FLIGHT.dec(route=route)
+    except HTTPException as e:
+        return route, request, e.get_response()
+    except Exception as e:
+        print(f"❌ Error in {route}: {e}")
+        return route, request, InternalServerError().get_response()
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await get_async_client().close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI entry point."""
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    started = time.perf_counter()
+    route, request, response = await _dispatch(scope, receive)
+    if response is None:
+        return
+
+    if request is not None:
+        # What Flask-Login's and Flask's after-request hooks do
+        if request.session.pop("_remember", None) == "clear":
+            response.delete_cookie(COOKIE_NAME, path="/")
+        _sessions.save_session(_flask_app, request.session, response)
+
+    total = time.perf_counter() - started
+    timings = request.timings if request is not None else {}
+    response.headers["Server-Timing"] = metrics.server_timing(total, timings)
+    metrics.REQUEST_SECONDS.observe(total, route=route)
+    metrics.REQUESTS_TOTAL.inc(route=route, status=response.status_code)
+    print(json.dumps({"route": route, "status": response.status_code,
+                      "ms": round(total * 1000, 1),
+                      "stages": {k: round(v * 1000, 1) for k, v in timings.items()}}))
+
+    await send({
+        "type": "http.response.start",
+        "status": response.status_code,
+        "headers": [(k.lower().encode("latin-1"), v.encode("latin-1"))
+                    for k, v in response.headers.items()],
+    })
+    await send({"type": "http.response.body",
+                "body": b"" if scope["method"] == "HEAD" else response.get_data()})
+
+
+STARTUP_SECONDS = time.perf_counter() - _import_started
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run("auth_async:app", host="0.0.0.0", port=int(os.getenv('AUTH_PORT', 5001)))
@@ -0,0 +1,220 @@
+"""Micro-benchmarks for the daltonize kernel.
+
+Runs every defect over a matrix of synthetic image sizes and aspect ratios
+and reports megapixels/sec, per-stage time and peak memory. Each case runs
+in a fresh process so its RSS peak isn't inherited from earlier cases.
+
+    python benchmark.py --out baseline.json
+    python benchmark.py --sizes vga,1080p --compare baseline.json
+"""
+import argparse
+import json
+import math
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from daltonize import DEFECTS, daltonize_variants, linearize, delinearize
+from image_io import decode_image, encode_image
+
+# Megapixels per named size
+SIZES = {"vga": 0.3072, "1080p": 2.0736, "4k": 8.2944, "12mp": 12.0}
+
+# Width / height
+ASPECTS = {"4:3": 4 / 3, "16:9": 16 / 9, "1:1": 1.0, "3:4": 3 / 4}
+
+# Relative change that counts as a regression in --compare mode
+DEFAULT_THRESHOLD = 0.10
+
+
+def dimensions(megapixels, aspect):
+    width = round(math.sqrt(megapixels * 1e6 * aspect))
+    return width, round(megapixels * 1e6 / width)
+
+
+def synthetic_image(width, height, seed=0):
+    """Smooth color regions plus sensor-like noise, so PNG sizes are realistic."""
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 256, (6, 8, 3), dtype=np.uint8)
+    img = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    noise = np.empty_like(img)
+    cv2.setRNGSeed(seed)
+    cv2.randu(noise, 0, 12)
+    cv2.add(img, noise, dst=img)
+    return img
+
+
+def _rss_mb():
+    # ru_maxrss is KB on Linux, bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1e6
+
+
+def _best(fn, repeat):
+    """Fastest of repeat runs, in seconds, plus the last result."""
+    best, result = math.inf, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def run_case(defect, width, height, repeat=3, formulas=True):
+    """Benchmark one defect at one size. Returns a JSON-ready dict."""
+    img = synthetic_image(width, height)
+    png = encode_image(img, ".png").tobytes()
+    rss_before = _rss_mb()
+
+    stages = {}
+    stages["png_decode"], _ = _best(lambda: decode_image(png), repeat)
+
+    # Kernel: best end-to-end run, with the stage split of that run
+    best_total, best_timings = math.inf, None
+    for _ in range(repeat):
+        timings = {}
+        started = time.perf_counter()
+        result = daltonize_variants(img, [(defect, 1.0)], timings=timings)[0]
+        total = time.perf_counter() - started
+        if total < best_total:
+            best_total, best_timings = total, timings
+    stages["daltonize"] = best_total
+    for stage, seconds in best_timings.items():
+        stages[f"daltonize.{stage}"] = seconds
+    rss_after = _rss_mb()
+
+    tracemalloc.start()
+    daltonize_variants(img, [(defect, 1.0)])
+    traced_peak = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+
+    stages["png_encode"], _ = _best(lambda: encode_image(result, ".png"), repeat)
+
+    # Reference gamma formulas the tables replace (full-frame float temporaries)
+    if formulas:
+        stages["linearize"], linear = _best(lambda: linearize(img.astype(np.float32)), repeat)
+        stages["delinearize"], _ = _best(lambda: delinearize(linear), repeat)
+
+    megapixels = width * height / 1e6
+    return {
+        "defect": defect,
+        "width": width,
+        "height": height,
+        "megapixels": round(megapixels, 3),
+        "mp_per_s": megapixels / stages["daltonize"],
+        "stages": stages,
+        "tracemalloc_peak_mb": traced_peak,
+        "rss_peak_mb": rss_after,
+        "rss_growth_mb": rss_after - rss_before,
+    }
+
+
+def run_isolated(*args):
+    # A single-use worker process per case keeps RSS peaks independent
+    with ProcessPoolExecutor(max_workers=1, max_tasks_per_child=1) as pool:
+        return pool.submit(run_case, *args).result()
+
+
+def case_key(result):
+    return result["defect"], result["width"], result["height"]
+
+
+def compare(current, baseline, threshold):
+    """Print the change against a baseline run. Returns the regressed cases."""
+    base = {case_key(r): r for r in baseline["results"]}
+    regressions = []
+    print(f"\n{'case':<32} {'MP/s':>16} {'traced MB':>16} {'RSS growth MB':>18}")
+    for r in current["results"]:
+        b = base.get(case_key(r))
+        if b is None:
+            continue
+        speed = r["mp_per_s"] / b["mp_per_s"] - 1
+        traced = r["tracemalloc_peak_mb"] / max(b["tracemalloc_peak_mb"], 1e-6) - 1
+        # RSS growth is noisy for small frames; ignore changes under 1 MB
+        rss_diff = r["rss_growth_mb"] - b["rss_growth_mb"]
+        rss = rss_diff / max(b["rss_growth_mb"], 1.0)
+
+        flags = []
+        if speed < -threshold:
+            flags.append("slower")
+        if traced > threshold:
+            flags.append("traced memory")
+        if rss > threshold and rss_diff > 1.0:
+            flags.append("RSS")
+        if flags:
+            regressions.append((case_key(r), flags))
+
+        name = f"{r['defect']} {r['width']}x{r['height']}"
+        print(f"{name:<32} {r['mp_per_s']:>8.1f} ({speed:+.0%}) "
+              f"{r['tracemalloc_peak_mb']:>8.1f} ({traced:+.0%}) "
+              f"{r['rss_growth_mb']:>10.1f} ({rss:+.0%})"
+              f"{'  ⚠️ ' + ', '.join(flags) if flags else ''}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default=",".join(SIZES),
+                        help=f"comma-separated subset of {', '.join(SIZES)}")
+    parser.add_argument("--aspects", default=",".join(ASPECTS),
+                        help=f"comma-separated subset of {', '.join(ASPECTS)}")
+    parser.add_argument("--defects", default=",".join(DEFECTS))
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, fastest is kept")
+    parser.add_argument("--no-formulas", action="store_true",
+                        help="skip the reference linearize()/delinearize() stages")
+    parser.add_argument("--in-process", action="store_true",
+                        help="run cases in this process (faster, RSS peaks accumulate)")
+    parser.add_argument("--out", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="baseline JSON to flag regressions against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="relative change that counts as a regression")
+    args = parser.parse_args(argv)
+
+    runner = run_case if args.in_process else run_isolated
+    results = []
+    for size in args.sizes.split(","):
+        for aspect in args.aspects.split(","):
+            width, height = dimensions(SIZES[size], ASPECTS[aspect])
+            for defect in args.defects.split(","):
+                r = runner(defect, width, height, args.repeat, not args.no_formulas)
+                results.append(r)
+                print(f"{defect:<13} {size:>6} {aspect:>5} {width}x{height}: "
+                      f"{r['mp_per_s']:7.1f} MP/s, "
+                      f"traced peak {r['tracemalloc_peak_mb']:.1f} MB, "
+                      f"RSS peak {r['rss_peak_mb']:.1f} MB")
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"❌ {len(regressions)} regression(s) against {args.compare}")
+            return 1
+        print(f"✅ No regressions against {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
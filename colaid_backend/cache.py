@@ -0,0 +1,209 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+# Bump when daltonize output changes so old entries and ETags stop matching
+CACHE_VERSION = 1
+
+# In-memory tier byte budget (0 disables it)
+RESULT_CACHE_BYTES = int(os.getenv('RESULT_CACHE_BYTES', 32 * 1024 * 1024))
+
+# Optional on-disk tier, shared by workers on the same host. Each worker
+# indexes the files it wrote or read and enforces the byte budget on those,
+# so the directory can hold up to workers × RESULT_CACHE_DISK_BYTES.
+RESULT_CACHE_DIR = os.getenv('RESULT_CACHE_DIR')
+RESULT_CACHE_DISK_BYTES = int(os.getenv('RESULT_CACHE_DISK_BYTES', 512 * 1024 * 1024))
+
+
+def content_hash(data):
+    """SHA-256 hex digest of uploaded bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def result_key(digest, *params):
+    """Cache key (also the strong ETag) for one result of an upload."""
+    raw = ":".join([str(CACHE_VERSION), digest] + [str(p) for p in params])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class ResultCache:
+    """Two-tier LRU cache of encoded results, bounded by bytes per tier."""
+
+    def __init__(self, memory_bytes=RESULT_CACHE_BYTES, disk_dir=RESULT_CACHE_DIR,
+                 disk_bytes=RESULT_CACHE_DISK_BYTES):
+        self.memory_bytes = memory_bytes
+        self.disk_dir = disk_dir
+        self.disk_bytes = disk_bytes
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> bytes, oldest first
+        self._memory_used = 0
+        self._disk = OrderedDict()  # key -> size, oldest first
+        self._disk_used = 0
+        self.counters = {
+            "hits_memory": 0, "hits_disk": 0, "misses": 0,
+            "evictions_memory": 0, "evictions_disk": 0,
+        }
+
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._load_disk_index()
+
+    def _load_disk_index(self):
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            path = os.path.join(self.disk_dir, name)
+            if name.endswith(".bin") and os.path.isfile(path):
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_used += size
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.bin")
+
+    def get(self, key):
+        """Return cached bytes for key, or None."""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.counters["hits_memory"] += 1
+                return data
+
+        data = self._read_disk(key)
+        with self._lock:
+            if data is None:
+                self.counters["misses"] += 1
+                return None
+            self.counters["hits_disk"] += 1
+            self._remember(key, data)
+        return data
+
+    def put(self, key, data):
+        with self._lock:
+            self._remember(key, data)
+        self._write_disk(key, data)
+
+    def _remember(self, key, data):
+        # Caller holds the lock
+        if len(data) > self.memory_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_used -= len(old)
+        self._memory[key] = data
+        self._memory_used += len(data)
+        while self._memory_used > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_used -= len(evicted)
+            self.counters["evictions_memory"] += 1
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # keeps disk LRU order across restarts
+        except OSError:
+            # Gone, most likely evicted by another worker sharing the directory
+            with self._lock:
+                self._forget_disk(key)
+            return None
+        with self._lock:
+            if key in self._disk:
+                self._disk.move_to_end(key)
+            else:  # written by another worker
+                self._disk[key] = len(data)
+                self._disk_used += len(data)
+        return data
+
+    def _write_disk(self, key, data):
+        if not self.disk_dir or len(data) > self.disk_bytes:
+            return
+        path = self._disk_path(key)
+        with self._lock:
+            if key in self._disk:
+                if os.path.exists(path):
+                    return
+                self._forget_disk(key)  # evicted by another worker, write it again
+        try:
+            # Write then rename so readers never see a partial file
+            fd, tmp = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"⚠️ Result cache write failed: {e}")
+            return
+
+        evicted = []
+        with self._lock:
+            self._forget_disk(key)  # a concurrent write of the same key
+            self._disk[key] = len(data)
+            self._disk_used += len(data)
+            while self._disk_used > self.disk_bytes and self._disk:
+                old_key, size = self._disk.popitem(last=False)
+                self._disk_used -= size
+                evicted.append(old_key)
+            self.counters["evictions_disk"] += len(evicted)
+        for old_key in evicted:
+            try:
+                os.remove(self._disk_path(old_key))
+            except OSError:
+                pass
+
+    def _forget_disk(self, key):
+        # Caller holds the lock
+        size = self._disk.pop(key, None)
+        if size is not None:
+            self._disk_used -= size
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters,
+                        memory_entries=len(self._memory), memory_bytes=self._memory_used,
+                        disk_entries=len(self._disk), disk_bytes=self._disk_used)
+
+
+class TTLCache:
+    """Small thread-safe cache whose entries expire after ttl seconds."""
+
+    def __init__(self, ttl, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, value), oldest first
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+result_cache = ResultCache()
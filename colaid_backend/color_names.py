@@ -0,0 +1,176 @@
+import os
+from functools import lru_cache
+from time import perf_counter
+
+import cv2
+import numpy as np
+
+from daltonize import DEFECTS, STRIP_MEMORY_BUDGET
+
+# Bits kept per channel when indexing the lookup tables: 6 gives a 64³
+# table (256 KB per table), 5 a 32³ one. Colors are classified at the
+# centre of their quantization cell.
+COLOR_TABLE_BITS = int(os.getenv('COLOR_TABLE_BITS', 6))
+
+# Names from getColorName in colaid/lib/utils/color_utils.dart, as label ids
+COLOR_NAMES = ("Black", "White", "Gray", "Red", "Orange",
+               "Yellow", "Green", "Blue", "Purple", "Pink")
+
+# CVD confusion zones from the firmware's is*Confused() (colaid_firmware.ino).
+# Hue bands are (low, high, min saturation, severity), matching low < h <= high;
+# the first protan/deutan band starts at -1 so that it includes 0°.
+CONFUSION_BANDS = {
+    "protanopia": [
+        (-1, 10, 10, 3), (10, 20, 10, 3), (20, 35, 10, 2), (35, 45, 10, 2),
+        (45, 60, 8, 2), (60, 80, 8, 2), (80, 100, 8, 3), (100, 130, 8, 3),
+        (130, 160, 8, 3), (160, 180, 12, 2), (180, 200, 15, 1),
+        (240, 260, 12, 1), (260, 280, 10, 2), (280, 300, 10, 2),
+        (300, 320, 10, 2), (320, 340, 10, 2), (340, 360, 10, 3),
+    ],
+    "deuteranopia": [
+        (-1, 10, 10, 3), (10, 20, 10, 3), (20, 35, 10, 3), (35, 45, 10, 2),
+        (45, 60, 8, 2), (60, 80, 8, 3), (80, 100, 8, 3), (100, 130, 8, 3),
+        (130, 160, 8, 3), (160, 175, 10, 2), (175, 195, 12, 2),
+        (195, 210, 15, 1), (240, 260, 12, 1), (260, 280, 10, 2),
+        (280, 300, 10, 2), (300, 320, 10, 2), (320, 340, 10, 2),
+        (340, 360, 10, 3),
+    ],
+    "tritanopia": [
+        (10, 20, 15, 1), (20, 35, 12, 2), (35, 45, 10, 2), (45, 60, 10, 3),
+        (60, 80, 10, 3), (80, 100, 10, 2), (100, 130, 15, 1),
+        (130, 160, 12, 2), (160, 175, 10, 3), (175, 195, 8, 3),
+        (195, 210, 8, 3), (210, 240, 8, 3), (240, 260, 10, 3),
+        (260, 280, 10, 3), (280, 300, 10, 3), (300, 320, 12, 2),
+        (320, 340, 12, 2), (340, 360, 15, 1),
+    ],
+}
+
+# Dark tones checked after the hue bands: (hue, saturation, value ranges
+# inclusive, severity). Brown and olive for red-green, navy for tritanopia.
+CONFUSION_DARK_TONES = {
+    "protanopia": [((15, 45), (15, 100), (15, 55), 3), ((50, 85), (10, 100), (15, 50), 3)],
+    "deuteranopia": [((15, 45), (15, 100), (15, 55), 3), ((50, 85), (10, 100), (15, 50), 3)],
+    "tritanopia": [((200, 260), (10, 100), (10, 45), 3)],
+}
+
+# Highest severity returned by confusion_table
+MAX_SEVERITY = 3
+
+
+def rgb_to_hsv(rgb):
+    """(..., 3) RGB floats in [0, 1] → hue (0-360), saturation and value (0-1).
+
+    Same branch order as the app and firmware: red wins ties, then green.
+    """
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    max_c = rgb.max(axis=-1)
+    delta = max_c - rgb.min(axis=-1)
+    safe = np.where(delta == 0, 1, delta)
+    hue = np.select(
+        [delta == 0, max_c == r, max_c == g],
+        [0.0, 60 * (((g - b) / safe) % 6), 60 * ((b - r) / safe + 2)],
+        60 * ((r - g) / safe + 4))
+    saturation = np.where(max_c == 0, 0, delta / np.where(max_c == 0, 1, max_c))
+    return hue, saturation, max_c
+
+
+def _cell_centres(bits):
+    """RGB in [0, 1] at the centre of every quantization cell, in index order."""
+    levels = 1 << bits
+    centre = ((np.arange(levels) << (8 - bits)) + ((1 << (8 - bits)) - 1) / 2) / 255
+    r, g, b = np.meshgrid(centre, centre, centre, indexing="ij")
+    return np.stack([r.ravel(), g.ravel(), b.ravel()], axis=-1)
+
+
+@lru_cache(maxsize=4)
+def label_table(bits=COLOR_TABLE_BITS):
+    """Quantized RGB index → COLOR_NAMES id, following getColorName."""
+    hue, sat, val = rgb_to_hsv(_cell_centres(bits))
+    table = np.select(
+        [val < 0.15, (val > 0.9) & (sat < 0.15), sat < 0.2,
+         hue < 15, hue < 45, hue < 65, hue < 170, hue < 260, hue < 290, hue < 345],
+        [0, 1, 2, 3, 4, 5, 6, 7, 8, 9],
+        3).astype(np.uint8)  # 345° and up wraps back to Red
+    table.setflags(write=False)
+    return table
+
+
+@lru_cache(maxsize=8)
+def confusion_table(defect, bits=COLOR_TABLE_BITS):
+    """Quantized RGB index → confusion severity (0-3) for a defect."""
+    hue, sat, val = rgb_to_hsv(_cell_centres(bits))
+    sat, val = sat * 100, val * 100  # the firmware works in percent
+
+    conditions = [val < 8, (sat < 5) & (val > 85)]
+    choices = [0, 0]
+    for low, high, min_sat, severity in CONFUSION_BANDS[defect]:
+        conditions.append((hue > low) & (hue <= high) & (sat >= min_sat))
+        choices.append(severity)
+    for (h0, h1), (s0, s1), (v0, v1), severity in CONFUSION_DARK_TONES[defect]:
+        conditions.append((hue >= h0) & (hue <= h1) & (sat >= s0) & (sat <= s1) &
+                          (val >= v0) & (val <= v1))
+        choices.append(severity)
+    table = np.select(conditions, choices, 0).astype(np.uint8)
+    table.setflags(write=False)
+    return table
+
+
+@lru_cache(maxsize=4)
+def _index_transform(bits):
+    """Per-level quantization table and the BGR weights that build the index."""
+    quantize = (np.arange(256) >> (8 - bits)).astype(np.int32)
+    weights = np.array([[1, 1 << bits, 1 << (2 * bits)]], dtype=np.float64)  # B, G, R
+    return quantize, weights
+
+
+def classify(image_bgr, defect, memory_budget=None, timings=None):
+    """Name every pixel and rate its confusion risk in one table lookup each.
+
+    Returns (labels, severity): uint8 maps the size of the image holding
+    COLOR_NAMES ids and 0-3 confusion severities for defect. The image is
+    indexed in horizontal strips bounded by memory_budget (default
+    STRIP_MEMORY_BUDGET). Raises ValueError for an unknown defect.
+    """
+    if defect not in DEFECTS:
+        raise ValueError(f"Unknown defect: {defect}")
+    if memory_budget is None:
+        memory_budget = STRIP_MEMORY_BUDGET
+
+    started = perf_counter()
+    labels_lut = label_table()
+    severity_lut = confusion_table(defect)
+    quantize, weights = _index_transform(COLOR_TABLE_BITS)
+    tables = perf_counter()
+
+    height, width = image_bgr.shape[:2]
+    labels = np.empty((height, width), dtype=np.uint8)
+    severity = np.empty((height, width), dtype=np.uint8)
+    if image_bgr.size == 0:
+        return labels, severity
+
+    # One int32 index plus three int32 quantized channels per pixel
+    rows = max(1, min(height, memory_budget // (width * 16)))
+    quantized = np.empty((rows, width, 3), dtype=np.int32)
+    index = np.empty((rows, width), dtype=np.int32)
+    for y in range(0, height, rows):
+        n = min(rows, height - y)
+        cv2.LUT(image_bgr[y:y + n], quantize, dst=quantized[:n])
+        cv2.transform(quantized[:n], weights, dst=index[:n])
+        np.take(labels_lut, index[:n], out=labels[y:y + n], mode='clip')
+        np.take(severity_lut, index[:n], out=severity[y:y + n], mode='clip')
+
+    if timings is not None:
+        timings["tables"] = timings.get("tables", 0.0) + tables - started
+        timings["lookup"] = timings.get("lookup", 0.0) + perf_counter() - tables
+    return labels, severity
+
+
+def summarize(labels, severity):
+    """Area per color name and per confusion severity, in pixels."""
+    names = np.bincount(labels.ravel(), minlength=len(COLOR_NAMES))
+    levels = np.bincount(severity.ravel(), minlength=MAX_SEVERITY + 1)
+    return {
+        "pixels": int(labels.size),
+        "colors": {name: int(count) for name, count in zip(COLOR_NAMES, names) if count},
+        "confusion": [int(count) for count in levels],
+    }
@@ -0,0 +1,374 @@
+import atexit
+import math
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from daltonize import daltonize_variants, STRIP_MEMORY_BUDGET
+from color_names import classify, summarize, COLOR_NAMES
+from lut import apply_lut, parse_lut, encoded_lut, MAX_PARSED_LUT_SIZE, EXPANDED_PLANE_BYTES
+from image_io import decode_image, decode_view, encode_image, image_size, plan_decode
+from metrics import current_rss_bytes
+
+# Worker processes that own image work (0 runs jobs inline, for development)
+COMPUTE_WORKERS = int(os.getenv('COMPUTE_WORKERS', 1))
+
+# Jobs allowed to wait or run at once before new ones are turned away
+COMPUTE_MAX_PENDING = int(os.getenv('COMPUTE_MAX_PENDING', 4))
+
+# Estimated memory all admitted jobs on the host may hold at once (512MB
+# hosts). Every web worker process has its own engine and pool, so each one
+# admits an equal share: the budget divided by WEB_CONCURRENCY, the worker
+# count gunicorn itself reads (start it with WEB_CONCURRENCY=N, not -w N).
+COMPUTE_MEMORY_BUDGET = int(os.getenv('COMPUTE_MEMORY_BUDGET', 256 * 1024 * 1024))
+WEB_CONCURRENCY = max(1, int(os.getenv('WEB_CONCURRENCY', 1)))
+
+# Worker processes are replaced after this many jobs to contain fragmentation
+COMPUTE_MAX_JOBS_PER_WORKER = int(os.getenv('COMPUTE_MAX_JOBS_PER_WORKER', 50))
+
+# Longest a request waits for its job before giving up
+COMPUTE_TIMEOUT = float(os.getenv('COMPUTE_TIMEOUT', 120))
+
+
+class ComputeSaturated(Exception):
+    """The engine can't take the job right now; retry after retry_after seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class JobTooLarge(Exception):
+    """The job needs more memory than the whole budget."""
+
+
+class ComputeEngine:
+    """Bounded process pool for image work with admission control.
+
+    Each job declares an estimated memory cost. Jobs are refused with
+    ComputeSaturated when max_pending jobs are already admitted or their
+    combined cost would exceed memory_budget, instead of queueing forever.
+    Limits apply to this process only (see COMPUTE_MEMORY_BUDGET).
+    """
+
+    def __init__(self, workers=COMPUTE_WORKERS, max_pending=COMPUTE_MAX_PENDING,
+                 memory_budget=COMPUTE_MEMORY_BUDGET // WEB_CONCURRENCY,
+                 max_jobs_per_worker=COMPUTE_MAX_JOBS_PER_WORKER):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.memory_budget = memory_budget
+        self.max_jobs_per_worker = max_jobs_per_worker
+
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pending = 0
+        self._reserved = 0
+        self._avg_seconds = 1.0  # moving average of job duration
+
+    def _get_executor(self):
+        # Created on first use so importing the app never forks
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    max_tasks_per_child=self.max_jobs_per_worker or None)
+            return self._executor
+
+    def _reset_executor(self, broken):
+        with self._lock:
+            if self._executor is broken:
+                self._executor = None
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def retry_after(self):
+        """Seconds until a slot is likely free, for the Retry-After header."""
+        slots = max(1, self.workers)
+        return max(1, math.ceil(self._avg_seconds * self._pending / slots))
+
+    def _admit(self, memory):
+        if memory > self.memory_budget:
+            raise JobTooLarge(f"Job needs {memory} bytes, budget is {self.memory_budget}")
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise ComputeSaturated("Image queue is full", self.retry_after())
+            if self._reserved + memory > self.memory_budget:
+                raise ComputeSaturated("Image memory budget is full", self.retry_after())
+            self._pending += 1
+            self._reserved += memory
+
+    def _release(self, memory, seconds):
+        with self._lock:
+            self._pending -= 1
+            self._reserved -= memory
+            if seconds is not None:
+                self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * seconds
+
+    def run(self, fn, *args, memory=0, timeout=COMPUTE_TIMEOUT):
+        """Run fn(*args) on the pool and return its result.
+
+        Raises JobTooLarge, ComputeSaturated (also when the job times out or
+        its worker dies), or whatever fn raised.
+        """
+        self._admit(memory)
+        started = time.perf_counter()
+        seconds = None
+        release = True
+        try:
+            if self.workers <= 0:
+                result = fn(*args)
+            else:
+                executor = self._get_executor()
+                try:
+                    future = executor.submit(fn, *args)
+                    result = future.result(timeout)
+                except TimeoutError:
+                    # A running job can't be cancelled: its slot and memory
+                    # stay reserved until the worker really finishes it
+                    if not future.cancel():
+                        release = False
+                        future.add_done_callback(lambda f: self._release(memory, None))
+                    raise ComputeSaturated("Image processing timed out", self.retry_after())
+                except BrokenProcessPool:
+                    self._reset_executor(executor)
+                    raise ComputeSaturated("Image worker crashed", self.retry_after())
+            seconds = time.perf_counter() - started
+            return result
+        finally:
+            if release:
+                self._release(memory, seconds)
+
+    def reserve(self, memory):
+        """Admit a long-running job that feeds the pool itself through
+        submit. Raises JobTooLarge or ComputeSaturated like run; the job
+        holds its slot and memory until release."""
+        self._admit(memory)
+
+    def release(self, memory):
+        self._release(memory, None)
+
+    def submit(self, fn, *args):
+        """Start fn(*args) on the pool for a job admitted with reserve and
+        return its Future. Raises ComputeSaturated if the pool has died."""
+        if self.workers <= 0:
+            future = Future()
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        executor = self._get_executor()
+        try:
+            return executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self._reset_executor(executor)
+            raise ComputeSaturated("Image worker crashed", self.retry_after())
+
+    def stats(self):
+        with self._lock:
+            return {"pending": self._pending, "reserved_bytes": self._reserved}
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def job_memory(data, variants, plan=None):
+    """Estimated peak bytes for process_image, or None if the header is unreadable."""
+    if plan is None:
+        plan = plan_decode(data)
+        if plan is None:
+            return None
+    (width, height), _, (out_w, out_h), reduction = plan
+    decoded = -(-width // reduction) * -(-height // reduction) * 3
+    # Encoded input + decoded frame + one output and one encoded copy per variant
+    return len(data) + decoded + out_w * out_h * 3 * 2 * len(variants) + STRIP_MEMORY_BUDGET
+
+
+def process_image(data, variants, ext=".png", params=(), plan=None):
+    """Pool job: decode, correct each (defect, intensity) variant and encode.
+
+    With a plan from image_io.plan_decode only that view of the image is
+    decoded and corrected.
+
+    Returns (encoded, stats): a list of encoded bytes per variant (None if
+    the image can't be decoded) and a dict with per-stage seconds under
+    "timings", plus "job_seconds", "megapixels", "rss_bytes" (worker RSS
+    while every output is still held, i.e. the job's peak) and
+    "encoded_bytes".
+    """
+    started = time.perf_counter()
+    timings = {}
+    stats = {"timings": timings}
+
+    img = decode_image(data) if plan is None else decode_view(data, plan)
+    decoded = time.perf_counter()
+    timings["decode"] = decoded - started
+    if img is None:
+        stats["job_seconds"] = decoded - started
+        return None, stats
+    stats["megapixels"] = img.shape[0] * img.shape[1] / 1e6
+
+    color = {}
+    results = daltonize_variants(img, variants, timings=color)
+    for name, seconds in color.items():
+        timings[f"color_{name}"] = seconds
+    stats["rss_bytes"] = current_rss_bytes()
+    del img
+
+    encoding = time.perf_counter()
+    encoded = []
+    while results:
+        buf = encode_image(results.pop(0), ext, params)  # free each output as we go
+        if buf is None:
+            raise RuntimeError("Processing failed to encode output")
+        encoded.append(buf.tobytes())
+    finished = time.perf_counter()
+    timings["image_encode"] = finished - encoding
+    stats["encoded_bytes"] = sum(len(buf) for buf in encoded)
+    stats["job_seconds"] = finished - started
+    return encoded, stats
+
+
+def colors_memory(data):
+    """Estimated peak bytes for process_colors, or None if the header is unreadable."""
+    size = image_size(data)
+    if size is None:
+        return None
+    pixels = size[0] * size[1]
+    # Encoded input + decoded frame + label and severity maps and their PNGs
+    return len(data) + pixels * (3 + 2 * 2) + STRIP_MEMORY_BUDGET
+
+
+def process_colors(data, defect, region=None, maps=True):
+    """Pool job: name the colors of an image (or a region of it) and map
+    where they are confusable for defect.
+
+    region is (x, y, width, height) in image pixels, clipped to the image.
+    Returns (result, stats) like process_image, where result is None if the
+    image can't be decoded, else a dict with "summary" (see summarize, plus
+    the region and label names) and, when maps is true, "labels" and
+    "confusion" PNG bytes. labels holds COLOR_NAMES ids; confusion holds
+    severity × 85 so 0-3 spans the full grayscale range.
+    Raises ValueError if the region doesn't overlap the image.
+    """
+    started = time.perf_counter()
+    timings = {}
+    stats = {"timings": timings}
+
+    img = decode_image(data)
+    decoded = time.perf_counter()
+    timings["decode"] = decoded - started
+    if img is None:
+        stats["job_seconds"] = decoded - started
+        return None, stats
+    stats["megapixels"] = img.shape[0] * img.shape[1] / 1e6
+
+    height, width = img.shape[:2]
+    x, y, w, h = region or (0, 0, width, height)
+    x1, y1 = min(x + w, width), min(y + h, height)
+    if x >= x1 or y >= y1:
+        raise ValueError("Region is outside the image")
+    img = img[y:y1, x:x1]
+
+    color = {}
+    labels, severity = classify(img, defect, timings=color)
+    for name, seconds in color.items():
+        timings[f"color_{name}"] = seconds
+    del img
+
+    result = {"summary": dict(summarize(labels, severity), names=list(COLOR_NAMES),
+                              region=[x, y, x1 - x, y1 - y])}
+    stats["rss_bytes"] = current_rss_bytes()
+
+    if maps:
+        encoding = time.perf_counter()
+        np.multiply(severity, 85, out=severity)
+        for key, plane in (("labels", labels), ("confusion", severity)):
+            buf = encode_image(plane, ".png")
+            if buf is None:
+                raise RuntimeError("Processing failed to encode output")
+            result[key] = buf.tobytes()
+        timings["image_encode"] = time.perf_counter() - encoding
+    stats["job_seconds"] = time.perf_counter() - started
+    return result, stats
+
+
+def lut_memory(data, lut_data):
+    """Estimated peak bytes for process_lut, or None if the header is unreadable."""
+    memory = job_memory(data, [None])
+    if memory is None:
+        return None
+    return memory + len(lut_data) * 2 + MAX_PARSED_LUT_SIZE * EXPANDED_PLANE_BYTES
+
+
+def process_lut(data, lut_data):
+    """Pool job: apply a .cube or packed binary LUT to an image as PNG.
+
+    Returns (encoded, stats) like process_image, with a single output.
+    Raises ValueError if lut_data isn't a readable LUT.
+    """
+    started = time.perf_counter()
+    timings = {}
+    stats = {"timings": timings}
+
+    lut = parse_lut(lut_data)
+    parsed = time.perf_counter()
+    timings["lut_parse"] = parsed - started
+
+    img = decode_image(data)
+    decoded = time.perf_counter()
+    timings["decode"] = decoded - parsed
+    if img is None:
+        stats["job_seconds"] = decoded - started
+        return None, stats
+    stats["megapixels"] = img.shape[0] * img.shape[1] / 1e6
+
+    color = {}
+    result = apply_lut(img, lut, timings=color)
+    for name, seconds in color.items():
+        timings[f"color_{name}"] = seconds
+    stats["rss_bytes"] = current_rss_bytes()
+    del img
+
+    encoding = time.perf_counter()
+    buf = encode_image(result, ".png")
+    if buf is None:
+        raise RuntimeError("Processing failed to encode output")
+    finished = time.perf_counter()
+    timings["image_encode"] = finished - encoding
+    stats["job_seconds"] = finished - started
+    return [buf.tobytes()], stats
+
+
+# build_lut keeps about ten float32 grid-sized RGB arrays alive at its peak
+LUT_BUILD_BUFFERS = 10
+
+# Encoded bytes per grid point: "%.6f %.6f %.6f\n" for .cube, RGB for bin
+LUT_ENCODED_BYTES = {"cube": 27, "bin": 3}
+
+
+def lut_build_memory(size, fmt):
+    """Estimated peak bytes for process_build_lut."""
+    points = size ** 3
+    return points * 3 * 4 * LUT_BUILD_BUFFERS + points * LUT_ENCODED_BYTES[fmt]
+
+
+def process_build_lut(defect, intensity, size, fmt):
+    """Pool job: build and encode a correction LUT (see lut.encoded_lut).
+
+    Returns ([encoded], stats) like process_image.
+    """
+    started = time.perf_counter()
+    encoded = encoded_lut(defect, intensity, size, fmt)
+    seconds = time.perf_counter() - started
+    return [encoded], {"timings": {"lut_build": seconds}, "job_seconds": seconds}
+
+
+engine = ComputeEngine()
+atexit.register(engine.shutdown)
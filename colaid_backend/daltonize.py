@@ -1,6 +1,8 @@
+import os
 import numpy as np
 import cv2
-import gc
+from functools import lru_cache
+from time import perf_counter
 
 # --- Colorblind simulation matrices (float32 to save memory) ---
 PROTANOPIA = np.array([
@@ -21,8 +23,42 @@ TRITANOPIA = np.array([
     [0.000, 0.475, 0.525]
 ], dtype=np.float32)
 
-# Maximum image dimension to prevent OOM on free-tier hosting (512MB)
-MAX_DIMENSION = 1920
+# --- Error redistribution (RGB): the lost channel's error is shifted ---
+# --- into the two channels the viewer can still tell apart          ---
+PROTANOPIA_SHIFT = np.array([
+    [0.0, 0.0, 0.0],
+    [0.7, 0.0, 0.0],  # Green
+    [1.0, 0.0, 0.0]   # Blue (Stronger)
+], dtype=np.float32)
+
+DEUTERANOPIA_SHIFT = np.array([
+    [0.0, 1.0, 0.0],  # Red (Stronger)
+    [0.0, 0.0, 0.0],
+    [0.0, 0.7, 0.0]   # Blue
+], dtype=np.float32)
+
+TRITANOPIA_SHIFT = np.array([
+    [0.0, 0.0, 0.7],  # Red
+    [0.0, 0.0, 1.0],  # Green (Stronger)
+    [0.0, 0.0, 0.0]
+], dtype=np.float32)
+
+DEFECTS = {
+    "protanopia": (PROTANOPIA, PROTANOPIA_SHIFT),
+    "deuteranopia": (DEUTERANOPIA, DEUTERANOPIA_SHIFT),
+    "tritanopia": (TRITANOPIA, TRITANOPIA_SHIFT),
+}
+
+# Apply correction gently (natural look); scaled by the request intensity
+CORRECTION_GAIN = 1.5
+
+# Float working memory per strip. Images are processed in horizontal strips
+# so full-resolution photos fit on free-tier hosting (512MB).
+STRIP_MEMORY_BUDGET = int(os.getenv('STRIP_MEMORY_BUDGET', 8 * 1024 * 1024))
+
+# Resolution of the linear → sRGB encode table. 2^14 levels keeps the
+# table at 16 KB and the result within 1 level of the exact formula.
+ENCODE_LEVELS = 1 << 14
 
 
 # --- Gamma correction helpers ---
@@ -39,66 +75,129 @@ def delinearize(img):
                     1.055 * (img ** (1 / 2.4)) - 0.055).astype(np.float32)
 
 
-def resize_if_needed(img):
-    """Resize image if it exceeds MAX_DIMENSION to prevent memory overflow."""
-    h, w = img.shape[:2]
-    if max(h, w) > MAX_DIMENSION:
-        scale = MAX_DIMENSION / max(h, w)
-        new_w, new_h = int(w * scale), int(h * scale)
-        print(f"⚠️ Resizing image from {w}x{h} to {new_w}x{new_h} to save memory")
-        return cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_AREA)
-    return img
+# uint8 sRGB → linear float32, one entry per input level
+DECODE_TABLE = linearize(np.arange(256, dtype=np.float32))
+
+# Quantized linear [0, 1] → uint8 sRGB (truncated, like the formula path)
+ENCODE_TABLE = (delinearize(np.linspace(0.0, 1.0, ENCODE_LEVELS,
+                                        dtype=np.float32)) * 255).astype(np.uint8)
+
+
+@lru_cache(maxsize=64)
+def correction_matrix(defect, intensity=1.0):
+    """Fused linear-space correction for one defect, in RGB order.
+
+    Folds simulation, error redistribution and gain into a single matrix:
+    out = img + gain * shift @ (img - sim @ img).
+    """
+    sim, shift = DEFECTS[defect]
+    identity = np.eye(3, dtype=np.float64)
+    gain = CORRECTION_GAIN * float(intensity)
+    matrix = identity + gain * (shift.astype(np.float64) @
+                                (identity - sim.astype(np.float64)))
+    matrix.setflags(write=False)
+    return matrix
+
+
+@lru_cache(maxsize=64)
+def _encode_transform(defect, intensity):
+    """BGR correction matrix with the encode-table scale and rounding folded in."""
+    matrix = correction_matrix(defect, intensity)[::-1, ::-1]  # RGB → BGR
+    transform = np.empty((3, 4), dtype=np.float64)
+    transform[:, :3] = matrix * (ENCODE_LEVELS - 1)
+    transform[:, 3] = 0.5  # round to the nearest table level
+    transform.setflags(write=False)
+    return transform
+
+
+def strip_rows(width, memory_budget=None, float_buffers=1):
+    """Rows per strip so one strip's float32 + index buffers fit the budget."""
+    if memory_budget is None:
+        memory_budget = STRIP_MEMORY_BUDGET
+    row_bytes = width * 3 * (float_buffers * np.dtype(np.float32).itemsize +
+                             np.dtype(np.uint16).itemsize)
+    return max(1, memory_budget // row_bytes)
 
 
 # --- Daltonization ---
-def daltonize(image_bgr, defect):
-    # Resize to cap memory usage
-    image_bgr = resize_if_needed(image_bgr)
-
-    # Convert BGR → RGB
-    image = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
-    del image_bgr  # free original
-    img = linearize(image.astype(np.float32))
-    del image  # free RGB copy
-
-    if defect == "protanopia":
-        sim = img @ PROTANOPIA.T
-        error = img - sim
-        del sim
-        correction = np.zeros_like(img)
-        correction[..., 1] = error[..., 0] * 0.7  # Green
-        correction[..., 2] = error[..., 0] * 1.0  # Blue (Stronger)
-        del error
-
-    elif defect == "deuteranopia":
-        sim = img @ DEUTERANOPIA.T
-        error = img - sim
-        del sim
-        correction = np.zeros_like(img)
-        correction[..., 0] = error[..., 1] * 1.0  # Red (Stronger)
-        correction[..., 2] = error[..., 1] * 0.7  # Blue
-        del error
-
-    elif defect == "tritanopia":
-        sim = img @ TRITANOPIA.T
-        error = img - sim
-        del sim
-        correction = np.zeros_like(img)
-        correction[..., 0] = error[..., 2] * 0.7  # Red
-        correction[..., 1] = error[..., 2] * 1.0  # Green (Stronger)
-        del error
-
-    else:
-        return image_bgr
-
-    # Apply correction gently (natural look)
-    out = img + correction * 1.5
-    del img, correction
-    np.clip(out, 0, 1, out=out)  # in-place clip
-
-    out = (delinearize(out) * 255).astype(np.uint8)
-
-    gc.collect()  # force garbage collection
-
-    # Convert RGB → BGR
-    return cv2.cvtColor(out, cv2.COLOR_RGB2BGR)
+def daltonize(image_bgr, defect, intensity=1.0, memory_budget=None):
+    """Correct a uint8 BGR image for the given defect, at full resolution.
+
+    Table-driven: decode and encode go through DECODE_TABLE/ENCODE_TABLE and
+    the color math is one 3x3 transform. The image is processed in horizontal
+    strips sized by memory_budget (default STRIP_MEMORY_BUDGET), reusing one
+    float32 buffer; every step is per-pixel, so the output is bit-identical
+    for any strip height. Output differs from the per-pixel gamma formulas
+    by at most 1 level per channel. Unknown defects return the image unchanged.
+    """
+    return daltonize_variants(image_bgr, [(defect, intensity)], memory_budget)[0]
+
+
+def daltonize_variants(image_bgr, variants, memory_budget=None, timings=None):
+    """Correct one image for several (defect, intensity) pairs in one pass.
+
+    Each strip is linearized once and every variant is computed from that
+    shared buffer. Returns one image per variant, in order, each identical
+    to what daltonize() returns for that pair.
+
+    If a timings dict is given, seconds spent per stage ("linearize",
+    "correct", "encode") are added to it.
+    """
+    image_bgr = np.ascontiguousarray(image_bgr)
+    h, w = image_bgr.shape[:2]
+
+    jobs = []  # (encode transform, output) for the known defects
+    outputs = []
+    for defect, intensity in variants:
+        if defect not in DEFECTS:
+            outputs.append(image_bgr)
+            continue
+        out = np.empty_like(image_bgr)
+        jobs.append((_encode_transform(defect, float(intensity)), out))
+        outputs.append(out)
+
+    if not jobs or image_bgr.size == 0:
+        return outputs
+
+    # A single variant corrects the linear buffer in place, several need
+    # a scratch buffer so the shared one survives until the last variant
+    shared = len(jobs) > 1
+    rows = min(h, strip_rows(w, memory_budget, 2 if shared else 1))
+    lin = np.empty((rows, w, 3), dtype=np.float32)
+    work = np.empty_like(lin) if shared else lin
+    idx = np.empty((rows, w, 3), dtype=np.uint16)
+
+    linearize_s = correct_s = encode_s = 0.0
+
+    for y0 in range(0, h, rows):
+        y1 = min(y0 + rows, h)
+        strip_lin, strip_work, strip_idx = lin[:y1 - y0], work[:y1 - y0], idx[:y1 - y0]
+
+        # uint8 → linear float32
+        started = perf_counter()
+        cv2.LUT(image_bgr[y0:y1], DECODE_TABLE, dst=strip_lin)
+        linearized = perf_counter()
+        linearize_s += linearized - started
+
+        for transform, out in jobs:
+            # Correct and scale to encode-table indices
+            cv2.transform(strip_lin, transform, dst=strip_work)
+            np.clip(strip_work, 0, ENCODE_LEVELS - 1, out=strip_work)
+            corrected = perf_counter()
+
+            # Linear → uint8 sRGB, written straight into the output
+            np.copyto(strip_idx, strip_work, casting='unsafe')
+            # (indices are already in range, 'clip' skips the bounds check)
+            np.take(ENCODE_TABLE, strip_idx, out=out[y0:y1], mode='clip')
+            encoded = perf_counter()
+
+            correct_s += corrected - linearized
+            encode_s += encoded - corrected
+            linearized = encoded
+
+    if timings is not None:
+        for stage, seconds in (("linearize", linearize_s), ("correct", correct_s),
+                               ("encode", encode_s)):
+            timings[stage] = timings.get(stage, 0.0) + seconds
+
+    return outputs
@@ -0,0 +1,146 @@
+import os
+import threading
+
+from pymongo import MongoClient
+from pymongo.errors import ConfigurationError
+
+# Connection pool and timeouts for the per-process client
+MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', 20))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', 5000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', 10000))
+
+_lock = threading.Lock()
+_client = None
+_client_pid = None
+_db = None
+
+
+def get_client():
+    """MongoClient for this process, created on first use.
+
+    A client must not be shared across fork(), so a forked worker that
+    inherited one from its parent gets a fresh client of its own.
+    """
+    global _client, _client_pid, _db
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+
+    with _lock:
+        if _client is None or _client_pid != pid:
+            import certifi  # only needed once a connection is made
+
+            _client = MongoClient(
+                os.getenv("MONGODB_URI"),
+                tls=True,
+                tlsCAFile=certifi.where(),
+                maxPoolSize=MONGO_MAX_POOL_SIZE,
+                connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+                serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+                connect=False,
+            )
+            _client_pid = pid
+            _db = None
+    return _client
+
+
+def _app_database(client):
+    try:
+        return client.get_default_database()  # Uses database from connection string
+    except ConfigurationError:
+        return client.get_database('colaid')  # Fallback to 'colaid' database
+
+
+def get_plain_db():
+    """The app database without ensuring indexes, so nothing is written.
+
+    For read-only tools (inspect_db.py) that may run as a read-only user.
+    """
+    return _app_database(get_client())
+
+
+def get_db():
+    """The app database, with its indexes ensured once per process."""
+    global _db
+    client = get_client()
+    if _db is not None:
+        return _db
+
+    with _lock:
+        if _db is None:
+            db = _app_database(client)
+            try:
+                # Every auth route looks users up by username
+                db.users.create_index('username', unique=True)
+            except Exception as e:
+                print("MongoDB username index error ❌", e)
+            _db = db
+    return _db
+
+
+def use_client(client):
+    """Make this process use client instead of connecting to MONGODB_URI.
+
+    For local stand-ins such as mongomock (see loadtest.py).
+    """
+    global _client, _client_pid, _db
+    with _lock:
+        _client, _client_pid, _db = client, os.getpid(), None
+
+
+# --- Asyncio driver, for auth_async.py ---
+_async_client = None
+_async_client_pid = None
+_async_db = None
+
+
+def get_async_client():
+    """AsyncMongoClient for this process, created on first use.
+
+    Same settings as get_client(). Only touch it from the event loop that
+    serves requests; like the sync client it is replaced after fork().
+    """
+    global _async_client, _async_client_pid, _async_db
+    pid = os.getpid()
+    if _async_client is None or _async_client_pid != pid:
+        import certifi
+        from pymongo import AsyncMongoClient
+
+        _async_client = AsyncMongoClient(
+            os.getenv("MONGODB_URI"),
+            tls=True,
+            tlsCAFile=certifi.where(),
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+            serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+            connect=False,
+        )
+        _async_client_pid = pid
+        _async_db = None
+    return _async_client
+
+
+async def get_async_db():
+    """The app database on the async client, with its indexes ensured."""
+    global _async_db
+    client = get_async_client()
+    if _async_db is not None:
+        return _async_db
+
+    db = _app_database(client)
+    try:
+        # Idempotent, so concurrent first requests may both run it
+        await db.users.create_index('username', unique=True)
+    except Exception as e:
+        print("MongoDB username index error ❌", e)
+    _async_db = db
+    return _async_db
+
+
+def use_async_client(client):
+    """Make this process's async routes use client instead of MONGODB_URI."""
+    global _async_client, _async_client_pid, _async_db
+    _async_client, _async_client_pid, _async_db = client, os.getpid(), None
@@ -0,0 +1,254 @@
+import io
+import math
+import mmap
+import os
+import tempfile
+import uuid
+import zipfile
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+from flask import Request
+from PIL import Image
+
+# Uploads up to this size are spooled in memory; larger ones spill to a
+# named temp file that pool workers map by path (removed when the request
+# ends). Where a second open of a temp file isn't allowed (Windows) they
+# spill to an anonymous temp file and are read back into memory.
+UPLOAD_MEMORY_LIMIT = int(os.getenv('UPLOAD_MEMORY_LIMIT', 16 * 1024 * 1024))
+_SPILL_BY_PATH = os.name == 'posix'
+
+# Hard cap on request size, anything bigger is rejected with 413
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_UPLOAD_BYTES', 64 * 1024 * 1024))
+
+# Output formats: extension, mimetype and the imwrite flag of their knob
+# (quality for JPEG/WebP, zlib level 0-9 for PNG)
+OUTPUT_FORMATS = {
+    "jpeg": (".jpg", "image/jpeg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": (".webp", "image/webp", cv2.IMWRITE_WEBP_QUALITY),
+    "png": (".png", "image/png", cv2.IMWRITE_PNG_COMPRESSION),
+}
+
+# Format for clients that don't ask for one. JPEG encodes a 1920px photo
+# in ~10 ms at ~120 KB; lossless PNG takes ~150 ms and ~3 MB, and WebP
+# is the smallest but ~250 ms.
+DEFAULT_OUTPUT_FORMAT = os.getenv('DEFAULT_OUTPUT_FORMAT', 'jpeg')
+OUTPUT_JPEG_QUALITY = int(os.getenv('OUTPUT_JPEG_QUALITY', 85))
+OUTPUT_WEBP_QUALITY = int(os.getenv('OUTPUT_WEBP_QUALITY', 80))
+
+
+class UploadRequest(Request):
+    """Request that keeps small uploads in memory and spills large ones."""
+
+    def _get_file_stream(self, total_content_length, content_type,
+                         filename=None, content_length=None):
+        if total_content_length is not None and total_content_length <= UPLOAD_MEMORY_LIMIT:
+            return io.BytesIO()
+        if _SPILL_BY_PATH:
+            return tempfile.NamedTemporaryFile('w+b', prefix='colaid-upload-')
+        return tempfile.TemporaryFile('w+b')
+
+
+class SpilledUpload:
+    """An upload left in its spill file, handed to pool jobs by path.
+
+    Image functions in this module accept one wherever they take encoded
+    bytes and map the file instead of reading it onto the heap.
+    """
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+
+def read_upload(file):
+    """Return the raw bytes of an uploaded file, wherever it was spooled."""
+    stream = file.stream
+    if isinstance(stream, io.BytesIO):
+        return stream.getvalue()
+    stream.seek(0)
+    return stream.read()
+
+
+def open_upload(file):
+    """Return an uploaded image's bytes, or a SpilledUpload if it spilled to
+    a file workers can open (so it is never copied into this process)."""
+    stream = file.stream
+    if isinstance(stream, io.BytesIO) or not _SPILL_BY_PATH:
+        return read_upload(file)
+    stream.flush()
+    return SpilledUpload(stream.name, os.fstat(stream.fileno()).st_size)
+
+
+@contextmanager
+def upload_buffer(data):
+    """Yield a buffer over encoded bytes or a SpilledUpload (mapped read-only).
+
+    Views of a mapped buffer must be gone before the block ends.
+    """
+    if not isinstance(data, SpilledUpload):
+        yield data
+        return
+    if not data.size:
+        yield b''
+        return
+    with open(data.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        yield mapped
+
+
+# EXIF orientations that swap width and height when applied
+_TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+# JPEG can be decoded directly at 1/2, 1/4 or 1/8 scale
+_REDUCED_DECODE_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                         (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+def image_size(data):
+    """Read (width, height) from the image header without decoding pixels.
+
+    The size is as displayed, i.e. after EXIF orientation (which OpenCV
+    applies when decoding). Returns None if the header can't be parsed.
+    """
+    try:
+        source = data.path if isinstance(data, SpilledUpload) else io.BytesIO(data)
+        with Image.open(source) as header:
+            width, height = header.size
+            if header.getexif().get(0x0112, 1) in _TRANSPOSED_ORIENTATIONS:
+                width, height = height, width
+            return width, height
+    except Exception:
+        return None
+
+
+def is_jpeg(data):
+    with upload_buffer(data) as buf:
+        return buf[:3] == b'\xff\xd8\xff'
+
+
+def _imdecode(buffer, flags):
+    # Keep the ndarray view local so the buffer export ends on return
+    return cv2.imdecode(np.frombuffer(buffer, dtype=np.uint8), flags)
+
+
+def decode_image(data, flags=cv2.IMREAD_COLOR):
+    """Decode encoded image bytes (or a SpilledUpload). Returns None if invalid."""
+    if not len(data):
+        return None
+    with upload_buffer(data) as buf:
+        return _imdecode(buf, flags)
+
+
+def plan_decode(data, region=None, max_size=None):
+    """Work out how to decode just what a view of the image needs.
+
+    region is (x, y, width, height) in displayed image pixels and is clipped
+    to the image; max_size is a (width, height) box the result must fit in
+    (either side may be None), never upscaling. Returns (size, region,
+    output_size, reduction): the full image size, the clipped region, the
+    size to deliver and the JPEG decode reduction (1, 2, 4 or 8) to use.
+    Returns None if the header can't be parsed. Raises ValueError if the
+    region doesn't overlap the image.
+    """
+    size = image_size(data)
+    if size is None:
+        return None
+    width, height = size
+
+    x, y, w, h = region or (0, 0, width, height)
+    w, h = min(x + w, width) - x, min(y + h, height) - y
+    if w <= 0 or h <= 0:
+        raise ValueError("Region is outside the image")
+
+    scale = 1.0
+    if max_size is not None:
+        box_w, box_h = max_size
+        if box_w:
+            scale = min(scale, box_w / w)
+        if box_h:
+            scale = min(scale, box_h / h)
+    output = (max(1, round(w * scale)), max(1, round(h * scale)))
+
+    # Largest reduction whose decode still covers the output resolution
+    reduction = 1
+    if is_jpeg(data):
+        for factor, _ in _REDUCED_DECODE_FLAGS:
+            if w // factor >= output[0] and h // factor >= output[1]:
+                reduction = factor
+                break
+    return size, (x, y, w, h), output, reduction
+
+
+def decode_view(data, plan):
+    """Decode the region of a plan_decode plan at its output size.
+
+    JPEGs are decoded at the plan's reduced scale, so the full-resolution
+    frame never exists. Returns None if the image can't be decoded.
+    """
+    (width, height), (x, y, w, h), (out_w, out_h), reduction = plan
+    flags = dict(_REDUCED_DECODE_FLAGS).get(reduction, cv2.IMREAD_COLOR)
+    img = decode_image(data, flags)
+    if img is None:
+        return None
+
+    if (x, y, w, h) != (0, 0, width, height):
+        # Decoded dimensions round up, so map the region by the actual ratio
+        ry, rx = img.shape[0] / height, img.shape[1] / width
+        img = img[int(y * ry):math.ceil((y + h) * ry), int(x * rx):math.ceil((x + w) * rx)]
+    if img.shape[:2] != (out_h, out_w):
+        return cv2.resize(img, (out_w, out_h), interpolation=cv2.INTER_AREA)
+    return np.ascontiguousarray(img)  # drops the rest of the frame
+
+
+def output_params(fmt, knob=None):
+    """(ext, imwrite params) for an OUTPUT_FORMATS name and optional knob.
+
+    JPEG and WebP fall back to their default quality; PNG without a level
+    uses OpenCV's default compression.
+    """
+    ext, _, flag = OUTPUT_FORMATS[fmt]
+    if knob is None:
+        knob = {"jpeg": OUTPUT_JPEG_QUALITY, "webp": OUTPUT_WEBP_QUALITY}.get(fmt)
+    return ext, () if knob is None else (flag, knob)
+
+
+def encode_image(img, ext=".png", params=()):
+    """Encode an image to an in-memory buffer. Returns None on failure."""
+    ok, encoded = cv2.imencode(ext, img, list(params))
+    return encoded if ok else None
+
+
+def pack_multipart(parts):
+    """Pack (filename, mimetype, data) parts into a multipart/mixed body.
+
+    Returns (body, content_type).
+    """
+    boundary = uuid.uuid4().hex
+    chunks = []
+    for filename, mimetype, data in parts:
+        data = memoryview(data)
+        chunks.append((f'--{boundary}\r\n'
+                       f'Content-Type: {mimetype}\r\n'
+                       f'Content-Disposition: attachment; filename="{filename}"\r\n'
+                       f'Content-Length: {data.nbytes}\r\n\r\n').encode())
+        chunks.append(data)
+        chunks.append(b'\r\n')
+    chunks.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(chunks), f'multipart/mixed; boundary={boundary}'
+
+
+def pack_zip(parts):
+    """Pack (filename, mimetype, data) parts into an uncompressed zip archive.
+
+    Images are already compressed, so entries are stored as-is.
+    Returns (body, content_type).
+    """
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_STORED) as archive:
+        for filename, _, data in parts:
+            archive.writestr(filename, memoryview(data))
+    return buf.getvalue(), 'application/zip'
@@ -0,0 +1,622 @@
+from flask import Blueprint, request, jsonify, Response, g, send_file, url_for
+import re
+import json
+import time
+import metrics
+from daltonize import DEFECTS
+from image_io import (UploadRequest, MAX_UPLOAD_BYTES, OUTPUT_FORMATS, DEFAULT_OUTPUT_FORMAT,
+                      read_upload, open_upload, upload_buffer, plan_decode, output_params,
+                      pack_multipart, pack_zip)
+from compute import (engine, process_image, job_memory, process_colors, colors_memory, process_lut,
+                     lut_memory, process_build_lut, lut_build_memory, ComputeSaturated, JobTooLarge)
+from cache import result_cache, content_hash, result_key
+from live import (LiveSession, LIVE_MAX_MESSAGE_BYTES, acquire_session_slot,
+                  release_session_slot)
+from flask_sock import Sock
+from lut import LUT_SIZES, DEFAULT_LUT_SIZE, LUT_VERSION
+import video
+
+bp = Blueprint('images', __name__)
+sock = Sock()
+
+
+def init_app(app):
+    """Register the image routes and the upload handling they rely on."""
+    app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
+    app.request_class = UploadRequest
+    app.config['SOCK_SERVER_OPTIONS'] = {'ping_interval': 25, 'max_message_size': LIVE_MAX_MESSAGE_BYTES}
+    app.register_blueprint(bp)
+
+
+metrics.register(metrics.Gauge(
+    "colaid_compute_jobs", "Image jobs admitted to the compute engine",
+    lambda: {(): engine.stats()["pending"]}))
+metrics.register(metrics.Gauge(
+    "colaid_compute_reserved_bytes", "Estimated memory held by admitted image jobs",
+    lambda: {(): engine.stats()["reserved_bytes"]}))
+metrics.register(metrics.Gauge(
+    "colaid_result_cache", "Result cache counters and sizes",
+    lambda: {(("stat", k),): v for k, v in result_cache.stats().items()}))
+metrics.register(metrics.Gauge(
+    "colaid_video_jobs", "Video jobs held, by state",
+    lambda: {(("state", k),): v for k, v in video.job_counts().items()}))
+
+@bp.app_errorhandler(413)
+def upload_too_large(e):
+    return jsonify({"error": f"Image too large (max {MAX_UPLOAD_BYTES // (1024 * 1024)} MB)"}), 413
+
+@bp.app_errorhandler(JobTooLarge)
+def job_too_large(e):
+    return jsonify({"error": "Image has too many pixels to process"}), 413
+
+@bp.app_errorhandler(ComputeSaturated)
+def compute_saturated(e):
+    print(f"⏳ Image work refused: {e}")
+    return jsonify({"error": f"{e}, try again later"}), 503, {"Retry-After": str(e.retry_after)}
+
+# Correction strength accepted from clients (1.0 = default look)
+MAX_INTENSITY = 2.0
+
+# Most variants one /daltonize/batch request may ask for
+MAX_VARIANTS = 8
+
+SHA256_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+
+def parse_intensity(value):
+    """Parse an intensity form value. Raises ValueError if invalid."""
+    try:
+        intensity = float(value)
+    except (TypeError, ValueError):
+        raise ValueError("Intensity must be a number")
+    if not 0.0 <= intensity <= MAX_INTENSITY:
+        raise ValueError(f"Intensity must be between 0 and {MAX_INTENSITY:g}")
+    return intensity
+
+
+def parse_region(value):
+    """Parse an "x,y,width,height" region in image pixels.
+
+    Returns a tuple of ints, or None if value is empty. Raises ValueError
+    if invalid.
+    """
+    if not value:
+        return None
+    try:
+        region = tuple(int(part) for part in value.split(","))
+    except ValueError:
+        raise ValueError("Region must be x,y,width,height")
+    if len(region) != 4 or min(region[:2]) < 0 or min(region[2:]) <= 0:
+        raise ValueError("Region must be x,y,width,height")
+    return region
+
+
+def parse_max_size(form):
+    """Parse optional max_width/max_height fields into a (width, height) box.
+
+    Returns None when neither is given. Raises ValueError if invalid.
+    """
+    box = []
+    for field in ("max_width", "max_height"):
+        value = form.get(field)
+        if value in (None, ""):
+            box.append(None)
+            continue
+        try:
+            box.append(int(value))
+        except ValueError:
+            raise ValueError(f"{field} must be a whole number")
+        if box[-1] <= 0:
+            raise ValueError(f"{field} must be positive")
+    return None if box == [None, None] else tuple(box)
+
+
+# Lossless output with OpenCV's default settings
+PNG_OUTPUT = ("png", None)
+
+
+def parse_output(form, accept=None):
+    """Pick the output format and its knob for a request.
+
+    The output form field (jpeg, webp or png) wins; otherwise the best image
+    type in accept (a request's accept_mimetypes), else
+    DEFAULT_OUTPUT_FORMAT. quality (1-100, JPEG/WebP) or compression (0-9,
+    PNG) tune it. Returns (format, knob or None). Raises ValueError if
+    invalid.
+    """
+    fmt = form.get("output")
+    if fmt == "jpg":
+        fmt = "jpeg"
+    if fmt is None and accept is not None:
+        # Only types named outright count; */* or image/* keep the default
+        named = dict(accept)
+        ranked = [(named.get(mimetype, 0), -i, name)
+                  for i, (name, (_, mimetype, _)) in enumerate(OUTPUT_FORMATS.items())]
+        quality, _, best = max(ranked)
+        if quality > 0:
+            fmt = best
+    fmt = fmt or DEFAULT_OUTPUT_FORMAT
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Output must be one of {', '.join(OUTPUT_FORMATS)}")
+
+    field, low, high = ("compression", 0, 9) if fmt == "png" else ("quality", 1, 100)
+    value = form.get(field)
+    if value in (None, ""):
+        return fmt, None
+    try:
+        knob = int(value)
+    except ValueError:
+        raise ValueError(f"{field} must be a whole number")
+    if not low <= knob <= high:
+        raise ValueError(f"{field} must be between {low} and {high}")
+    return fmt, knob
+
+
+def result_params(defect, intensity, region=None, max_size=None, output=PNG_OUTPUT):
+    """Result key parameters; full-image PNG results keep their original keys."""
+    params = (defect, intensity)
+    if region is not None or max_size is not None:
+        params += (region, max_size)
+    if output != PNG_OUTPUT:
+        params += output
+    return params
+
+
+def parse_variants(raw):
+    """Parse a JSON list of defect names or {"defect", "intensity"} objects.
+
+    Returns a list of (defect, intensity) pairs. Raises ValueError if invalid.
+    """
+    try:
+        items = json.loads(raw)
+    except (TypeError, json.JSONDecodeError):
+        raise ValueError("Variants must be a JSON list")
+    if not isinstance(items, list) or not items:
+        raise ValueError("Variants must be a non-empty JSON list")
+    if len(items) > MAX_VARIANTS:
+        raise ValueError(f"At most {MAX_VARIANTS} variants per request")
+
+    variants = []
+    for item in items:
+        if isinstance(item, str):
+            item = {"defect": item}
+        if not isinstance(item, dict):
+            raise ValueError("Each variant must be a defect name or an object")
+        defect = item.get("defect")
+        if defect not in DEFECTS:
+            raise ValueError(f"Unknown defect: {defect}")
+        variants.append((defect, parse_intensity(item.get("intensity", 1.0))))
+    return variants
+
+
+def run_job(fn, memory, *args):
+    """Run an image job on the compute engine and record its stage timings.
+
+    fn(*args) must return (result, stats) like process_image. Returns the
+    result, or an error response (400 when the image can't be read or the
+    job rejects its arguments with ValueError). Saturation and oversized
+    jobs propagate to their error handlers.
+    """
+    if memory is None:
+        print("❌ Error: Could not read image header. Invalid format.")
+        return jsonify({"error": "Invalid image format"}), 400
+
+    print("Starting processing")
+    started = time.perf_counter()
+    try:
+        result, stats = engine.run(fn, *args, memory=memory)
+    except (ComputeSaturated, JobTooLarge):
+        raise
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"❌ Error during {fn.__name__}: {e}")
+        return jsonify({"error": str(e)}), 500
+
+    # Time not spent inside the job was queueing and IPC
+    metrics.record_stage("queue", time.perf_counter() - started - stats["job_seconds"])
+    for name, seconds in stats["timings"].items():
+        metrics.record_stage(name, seconds)
+    if "megapixels" in stats:
+        metrics.IMAGE_MEGAPIXELS.observe(stats["megapixels"])
+        metrics.JOB_PEAK_RSS_BYTES.observe(stats["rss_bytes"])
+
+    if result is None:
+        print("❌ Error: Could not decode image. Invalid format.")
+        return jsonify({"error": "Invalid image format"}), 400
+
+    print("Processing done")
+    return result
+
+
+def run_image_job(data, variants, region=None, max_size=None, output=PNG_OUTPUT):
+    """Process an upload (or one view of it) on the compute engine.
+
+    Returns a list of encoded bytes per variant in the output format, or an
+    error response.
+    """
+    plan = None
+    memory = job_memory(data, variants)
+    if region is not None or max_size is not None:
+        try:
+            plan = plan_decode(data, region, max_size)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        memory = None if plan is None else job_memory(data, variants, plan)
+
+    ext, params = output_params(*output)
+    outputs = run_job(process_image, memory, data, variants, ext, params, plan)
+    if isinstance(outputs, list):
+        encode_seconds = g.stage_timings.get("image_encode", 0.0)
+        metrics.ENCODE_SECONDS.observe(encode_seconds, format=output[0])
+        for encoded in outputs:
+            metrics.ENCODED_BYTES.observe(len(encoded), format=output[0])
+    return outputs
+
+
+def read_image_digest():
+    """Return (data, digest) for the request's image.
+
+    Without an upload, a valid image_sha256 form field is a hash-only probe
+    and gives (None, digest). Gives (None, None) if neither is present.
+    """
+    with metrics.stage("upload"):
+        upload = request.files.get("image")  # parses the multipart body
+        data = open_upload(upload) if upload else None
+
+    if data is not None:
+        metrics.UPLOAD_BYTES.observe(len(data))
+        with metrics.stage("hash"), upload_buffer(data) as buf:
+            return data, content_hash(buf)
+    digest = request.form.get("image_sha256", "").lower()
+    if SHA256_PATTERN.fullmatch(digest):
+        return None, digest
+    return None, None
+
+
+def cached_image_job(data, digest, variants, region=None, max_size=None, output=PNG_OUTPUT):
+    """Results per variant from result_cache, computing only the misses.
+
+    Returns a list of encoded bytes in the output format, or an error
+    response (404 when a hash-only probe misses, so the client knows to
+    upload).
+    """
+    keys = [result_key(digest, *result_params(defect, intensity, region, max_size, output))
+            for defect, intensity in variants]
+    with metrics.stage("cache"):
+        results = [result_cache.get(key) for key in keys]
+    missing = [i for i, result in enumerate(results) if result is None]
+    if not missing:
+        print("Cache hit")
+        return results
+
+    if data is None:
+        return jsonify({"error": "Image not cached, upload it"}), 404
+
+    outputs = run_image_job(data, [variants[i] for i in missing], region, max_size, output)
+    if not isinstance(outputs, list):
+        return outputs
+    for i, encoded in zip(missing, outputs):
+        result_cache.put(keys[i], encoded)
+        results[i] = encoded
+    return results
+
+
+@bp.route("/daltonize", methods=["POST"])
+def daltonize_api():
+    """Correct one upload. Form fields: image (or image_sha256 of a previous
+    upload), defect, optional intensity, region ("x,y,width,height") and
+    max_width/max_height (display size to fit, e.g. a phone preview),
+    output/quality/compression (see parse_output, also picked from Accept).
+    Honours If-None-Match."""
+    print("Request received")   
+
+    # Small uploads are read from memory; large ones stay in their spill file
+    data, digest = read_image_digest()
+    if digest is None:
+        return jsonify({"error": "No image uploaded"}), 400
+
+    defect = request.form.get("defect", "protanopia")
+    print("Defect:", defect)     
+    if defect not in DEFECTS:
+        return jsonify({"error": f"Unknown defect: {defect}"}), 400
+
+    try:
+        intensity = parse_intensity(request.form.get("intensity", 1.0))
+        region = parse_region(request.form.get("region"))
+        max_size = parse_max_size(request.form)
+        output = parse_output(request.form, request.accept_mimetypes)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Strong ETag: the same bytes, defect, intensity, view and output give the same result
+    etag = result_key(digest, *result_params(defect, intensity, region, max_size, output))
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    outputs = cached_image_job(data, digest, [(defect, intensity)], region, max_size, output)
+    if not isinstance(outputs, list):
+        return outputs
+
+    print(f"Image encoded as {output[0]}, Size: {len(outputs[0])} bytes")
+
+    response = Response(outputs[0], mimetype=OUTPUT_FORMATS[output[0]][1])
+    response.set_etag(etag)
+    response.vary.add("Accept")
+    return response
+
+
+@bp.route("/daltonize/batch", methods=["POST"])
+def daltonize_batch_api():
+    """One upload, several corrected variants returned together.
+
+    Form fields: image (or image_sha256 of a previous upload), variants
+    (JSON list, see parse_variants), optional format ("multipart" or
+    "zip", also picked from Accept) and the view and output fields of
+    /daltonize (Accept only picks the packing here).
+    """
+    print("Batch request received")
+
+    data, digest = read_image_digest()
+    if digest is None:
+        return jsonify({"error": "No image uploaded"}), 400
+
+    try:
+        variants = parse_variants(request.form.get("variants"))
+        region = parse_region(request.form.get("region"))
+        max_size = parse_max_size(request.form)
+        output = parse_output(request.form)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    print("Variants:", variants)
+
+    packing = request.form.get("format")
+    if packing is None:
+        packing = "zip" if request.accept_mimetypes.best_match(
+            ["multipart/mixed", "application/zip"]) == "application/zip" else "multipart"
+    if packing not in ("multipart", "zip"):
+        return jsonify({"error": "Format must be 'multipart' or 'zip'"}), 400
+
+    outputs = cached_image_job(data, digest, variants, region, max_size, output)
+    if not isinstance(outputs, list):
+        return outputs
+
+    ext, mimetype, _ = OUTPUT_FORMATS[output[0]]
+    parts = [(f"{defect}_{intensity:g}{ext}", mimetype, encoded)
+             for (defect, intensity), encoded in zip(variants, outputs)]
+
+    with metrics.stage("pack"):
+        body, content_type = (pack_zip if packing == "zip" else pack_multipart)(parts)
+    print(f"Batch encoded, {len(parts)} variants, Size: {len(body)} bytes")
+
+    return Response(body, content_type=content_type)
+
+
+@bp.route("/colors", methods=["POST"])
+def colors_api():
+    """Name the colors of a whole image and map its confusion zones.
+
+    Form fields: image, defect, optional region ("x,y,width,height") and
+    format: "multipart" (default) or "zip" return summary.json plus the
+    labels.png and confusion.png maps, "json" returns the summary alone.
+    """
+    print("Colors request received")
+
+    with metrics.stage("upload"):
+        upload = request.files.get("image")
+        data = open_upload(upload) if upload else None
+    if data is None:
+        return jsonify({"error": "No image uploaded"}), 400
+    metrics.UPLOAD_BYTES.observe(len(data))
+
+    defect = request.form.get("defect", "protanopia")
+    if defect not in DEFECTS:
+        return jsonify({"error": f"Unknown defect: {defect}"}), 400
+    try:
+        region = parse_region(request.form.get("region"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    packing = request.form.get("format", "multipart")
+    if packing not in ("multipart", "zip", "json"):
+        return jsonify({"error": "Format must be 'multipart', 'zip' or 'json'"}), 400
+
+    result = run_job(process_colors, colors_memory(data), data, defect, region,
+                     packing != "json")
+    if not isinstance(result, dict):
+        return result
+
+    summary = dict(result["summary"], defect=defect)
+    if packing == "json":
+        return jsonify(summary)
+
+    parts = [("summary.json", "application/json", json.dumps(summary).encode()),
+             ("labels.png", "image/png", result["labels"]),
+             ("confusion.png", "image/png", result["confusion"])]
+    with metrics.stage("pack"):
+        body, content_type = (pack_zip if packing == "zip" else pack_multipart)(parts)
+    return Response(body, content_type=content_type)
+
+
+# LUTs never change for a given version, so clients may keep them a day
+LUT_MAX_AGE = 24 * 3600
+
+
+@bp.route("/lut/<defect>", methods=["GET"])
+def lut_api(defect):
+    """3D LUT of the correction for one defect, to apply on-device.
+
+    Query: optional intensity, size (one of LUT_SIZES) and format ("cube"
+    for .cube text, "bin" for the packed binary in lut.py). Honours
+    If-None-Match.
+    """
+    if defect not in DEFECTS:
+        return jsonify({"error": f"Unknown defect: {defect}"}), 400
+    try:
+        intensity = parse_intensity(request.args.get("intensity", 1.0))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        size = int(request.args.get("size", DEFAULT_LUT_SIZE))
+    except ValueError:
+        size = None
+    if size not in LUT_SIZES:
+        return jsonify({"error": f"Size must be one of {', '.join(map(str, LUT_SIZES))}"}), 400
+    fmt = request.args.get("format", "cube")
+    if fmt not in ("cube", "bin"):
+        return jsonify({"error": "Format must be 'cube' or 'bin'"}), 400
+
+    etag = result_key("lut", LUT_VERSION, defect, intensity, size, fmt)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        # Built on the compute engine and cached by bytes with the images
+        with metrics.stage("cache"):
+            body = result_cache.get(etag)
+        if body is None:
+            outputs = run_job(process_build_lut, lut_build_memory(size, fmt),
+                              defect, intensity, size, fmt)
+            if not isinstance(outputs, list):
+                return outputs
+            body = outputs[0]
+            result_cache.put(etag, body)
+        response = Response(body, mimetype="text/plain" if fmt == "cube" else "application/octet-stream")
+        response.headers["Content-Disposition"] = (
+            f'attachment; filename="{defect}_{intensity:g}_{size}.{fmt}"')
+    response.set_etag(etag)
+    response.headers["X-LUT-Version"] = str(LUT_VERSION)
+    response.cache_control.public = True
+    response.cache_control.max_age = LUT_MAX_AGE
+    return response
+
+
+@bp.route("/lut/apply", methods=["POST"])
+def lut_apply_api():
+    """Apply an uploaded LUT to an image. Form fields: image and lut (a
+    .cube file or packed binary LUT). Returns PNG."""
+    with metrics.stage("upload"):
+        upload = request.files.get("image")
+        data = open_upload(upload) if upload else None
+        lut_upload = request.files.get("lut")
+        lut_data = read_upload(lut_upload) if lut_upload else None
+    if data is None:
+        return jsonify({"error": "No image uploaded"}), 400
+    if not lut_data:
+        return jsonify({"error": "No LUT uploaded"}), 400
+    metrics.UPLOAD_BYTES.observe(len(data))
+
+    outputs = run_job(process_lut, lut_memory(data, lut_data), data, lut_data)
+    if not isinstance(outputs, list):
+        return outputs
+    return Response(outputs[0], mimetype="image/png")
+
+
+@bp.route("/video/daltonize", methods=["POST"])
+def video_daltonize_api():
+    """Start correcting a video clip. Form fields: video, defect and
+    optional intensity. Answers 202 with the job's progress; poll its
+    Location for progress, then fetch the MP4 from its result URL."""
+    upload = request.files.get("video")
+    if upload is None:
+        return jsonify({"error": "No video uploaded"}), 400
+    try:
+        with metrics.stage("upload"):
+            job = video.start_job(upload, request.form.get("defect", "protanopia"),
+                                  parse_intensity(request.form.get("intensity", 1.0)))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if job is None:
+        raise ComputeSaturated("Too many video jobs running", retry_after=30)
+
+    print(f"🎬 Video job {job.id} started: {job.width}x{job.height}, "
+          f"{job.total_frames} frames, {job.defect}")
+    location = url_for("images.video_job_api", job_id=job.id)
+    return jsonify(video_progress(job)), 202, {"Location": location}
+
+
+def video_progress(job):
+    progress = job.progress()
+    progress["status_url"] = url_for("images.video_job_api", job_id=job.id)
+    if job.state == "done":
+        progress["result_url"] = url_for("images.video_result_api", job_id=job.id)
+    return progress
+
+
+@bp.route("/video/jobs/<job_id>", methods=["GET", "DELETE"])
+def video_job_api(job_id):
+    """Progress of a video job; DELETE cancels it."""
+    job = video.get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown video job"}), 404
+    if request.method == "DELETE":
+        job.cancel()
+        job.join(timeout=5)
+    return jsonify(video_progress(job))
+
+
+@bp.route("/video/jobs/<job_id>/result", methods=["GET"])
+def video_result_api(job_id):
+    job = video.get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown video job"}), 404
+    if job.state != "done":
+        return jsonify({"error": f"Video job is {job.state}"}), 409
+    return send_file(job.output, mimetype="video/mp4", as_attachment=True,
+                     download_name=f"colaid-{job.defect}.mp4")
+
+
+@sock.route("/live", bp=bp)
+def live_stream(ws):
+    """Live frame correction over a WebSocket.
+
+    Query: defect and optional intensity. Binary messages are encoded frames
+    (JPEG/PNG), each answered with the corrected frame as JPEG. Text messages
+    are JSON: {"defect", "intensity"} reconfigures the session and
+    {"stats": true} returns tile counters; both are answered with JSON.
+    """
+    if not acquire_session_slot():
+        ws.close(reason=1013, message="Too many live sessions, try again later")
+        return
+
+    session = None
+    try:
+        try:
+            session = LiveSession(request.args.get("defect", "protanopia"),
+                                  parse_intensity(request.args.get("intensity", 1.0)))
+        except ValueError as e:
+            ws.close(reason=1008, message=str(e))
+            return
+        print(f"🎥 Live session started: {session.defect}")
+
+        while True:
+            message = ws.receive()
+            if isinstance(message, (bytes, bytearray)):
+                try:
+                    ws.send(session.handle_frame(message))
+                except ValueError as e:
+                    ws.send(json.dumps({"error": str(e)}))
+                continue
+
+            try:
+                command = json.loads(message)
+                if not isinstance(command, dict):
+                    raise ValueError("Commands must be JSON objects")
+                if command.get("stats"):
+                    ws.send(json.dumps(session.stats()))
+                    continue
+                intensity = command.get("intensity")
+                session.configure(command.get("defect"),
+                                  None if intensity is None else parse_intensity(intensity))
+                ws.send(json.dumps({"defect": session.defect, "intensity": session.intensity}))
+            except ValueError as e:
+                ws.send(json.dumps({"error": str(e)}))
+    finally:
+        release_session_slot()
+        if session is not None:
+            print(f"🎥 Live session closed: {session.stats()}")
+
+
+@bp.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    return jsonify(result_cache.stats())
@@ -1,15 +1,175 @@
-from app import app, db, User
-
-def inspect():
-    with app.app_context():
-        users = User.query.all()
-        print(f"Total Users: {len(users)}")
-        print("-" * 30)
-        print(f"{'ID':<5} | {'Username'}")
-        print("-" * 30)
-        for user in users:
-            print(f"{user.id:<5} | {user.username}")
-        print("-" * 30)
+"""Inspect and export the users collection without loading it into memory.
+
+Users are streamed from batched cursors with a projection that never
+fetches password hashes, and exports are written row by row, so memory
+stays flat however large the collection grows. Stats are computed by
+MongoDB's aggregation pipeline; only the results come back.
+
+    python inspect_db.py list --limit 50
+    python inspect_db.py export --format csv --out users.csv
+    python inspect_db.py stats --by month
+"""
+import argparse
+import csv
+import json
+import sys
+
+from dotenv import load_dotenv
+
+# Before database is imported, so MONGODB_URI and friends come from .env
+load_dotenv()
+
+from pymongo import ReadPreference
+
+from database import get_plain_db
+
+# Only these fields ever leave the server; password_hash is never fetched
+USER_PROJECTION = {"_id": 1, "username": 1}
+
+EXPORT_FIELDS = ("id", "username", "created_at")
+
+# Documents per cursor batch (one round trip each)
+DEFAULT_BATCH_SIZE = 1000
+
+# Username the guest login shares
+GUEST_USERNAME = "Guest"
+
+DATE_FORMATS = {"day": "%Y-%m-%d", "month": "%Y-%m", "year": "%Y"}
+
+
+def users_collection():
+    # Admin scans read from a secondary when there is one, away from app
+    # traffic; get_plain_db skips get_db's index creation, which is a write
+    return get_plain_db().users.with_options(read_preference=ReadPreference.SECONDARY_PREFERRED)
+
+
+def stream_users(batch_size=DEFAULT_BATCH_SIZE, limit=0):
+    """Yield export rows for every user, in _id (creation) order."""
+    cursor = (users_collection()
+              .find({}, USER_PROJECTION, batch_size=batch_size, limit=limit)
+              .sort("_id", 1))
+    with cursor:
+        for doc in cursor:
+            yield {
+                "id": str(doc["_id"]),
+                "username": doc.get("username"),
+                # ObjectIds embed their creation time
+                "created_at": doc["_id"].generation_time.isoformat(),
+            }
+
+
+def stats_pipeline(by="month"):
+    """Aggregation computing totals and signups per period in one pass."""
+    return [
+        {"$project": {
+            "username": {"$ifNull": ["$username", ""]},
+            "created": {"$toDate": "$_id"},
+            # Evaluated on the server; the hash itself is never returned
+            "has_password": {"$eq": [{"$type": "$password_hash"}, "string"]},
+        }},
+        {"$facet": {
+            "totals": [{"$group": {
+                "_id": None,
+                "users": {"$sum": 1},
+                "guests": {"$sum": {"$cond": [{"$eq": ["$username", GUEST_USERNAME]}, 1, 0]}},
+                "without_password": {"$sum": {"$cond": ["$has_password", 0, 1]}},
+                "first_signup": {"$min": "$created"},
+                "last_signup": {"$max": "$created"},
+                "avg_username_length": {"$avg": {"$strLenCP": "$username"}},
+            }}],
+            "signups": [
+                {"$group": {"_id": {"$dateToString": {"format": DATE_FORMATS[by], "date": "$created"}},
+                            "users": {"$sum": 1}}},
+                {"$sort": {"_id": 1}},
+            ],
+        }},
+    ]
+
+
+def user_stats(by="month"):
+    result = next(users_collection().aggregate(stats_pipeline(by), allowDiskUse=True))
+    totals = result["totals"][0] if result["totals"] else {"users": 0}
+    totals.pop("_id", None)
+    for key in ("first_signup", "last_signup"):
+        if totals.get(key) is not None:
+            totals[key] = totals[key].isoformat()
+    totals["signups"] = {row["_id"]: row["users"] for row in result["signups"]}
+    return totals
+
+
+# --- Commands ---
+def list_users(args):
+    print(f"{'ID':<24} | {'Created':<25} | Username")
+    print("-" * 70)
+    count = 0
+    for row in stream_users(args.batch_size, args.limit):
+        print(f"{row['id']:<24} | {row['created_at']:<25} | {row['username']}")
+        count += 1
+    print("-" * 70)
+    print(f"{count} users listed")
+
+
+def export_users(args):
+    out = open(args.out, "w", newline="") if args.out else sys.stdout
+    try:
+        if args.format == "csv":
+            writer = csv.DictWriter(out, fieldnames=EXPORT_FIELDS)
+            writer.writeheader()
+            write = writer.writerow
+        else:
+            def write(row):
+                out.write(json.dumps(row) + "\n")
+
+        count = 0
+        for row in stream_users(args.batch_size, args.limit):
+            write(row)
+            count += 1
+            if args.out and count % args.batch_size == 0:
+                print(f"  {count} users exported", file=sys.stderr)
+    finally:
+        if args.out:
+            out.close()
+    print(f"✅ Exported {count} users" + (f" to {args.out}" if args.out else ""), file=sys.stderr)
+
+
+def show_stats(args):
+    stats = user_stats(args.by)
+    if args.json:
+        print(json.dumps(stats, indent=2))
+        return
+    signups = stats.pop("signups")
+    for key, value in stats.items():
+        print(f"{key:<20} {value:.1f}" if isinstance(value, float) else f"{key:<20} {value}")
+    if signups:
+        print(f"\nSignups per {args.by}:")
+        for period, users in signups.items():
+            print(f"  {period:<10} {users}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command")
+
+    list_parser = commands.add_parser("list", help="print users as a table")
+    export_parser = commands.add_parser("export", help="write users as JSON lines or CSV")
+    export_parser.add_argument("--format", choices=("jsonl", "csv"), default="jsonl")
+    export_parser.add_argument("--out", help="output file (default: stdout)")
+    for sub in (list_parser, export_parser):
+        sub.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                         help="documents fetched per round trip")
+        sub.add_argument("--limit", type=int, default=0, help="stop after this many users (0 = all)")
+
+    stats_parser = commands.add_parser("stats", help="aggregate stats computed by MongoDB")
+    stats_parser.add_argument("--by", choices=DATE_FORMATS, default="month",
+                              help="period to count signups by")
+    stats_parser.add_argument("--json", action="store_true", help="print stats as JSON")
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        args = parser.parse_args(["list"])
+    {"list": list_users, "export": export_users, "stats": show_stats}[args.command](args)
+    return 0
+
 
 if __name__ == "__main__":
-    inspect()
+    sys.exit(main())
@@ -0,0 +1,142 @@
+import os
+import threading
+
+import cv2
+import numpy as np
+
+from daltonize import daltonize, DEFECTS
+from image_io import decode_image, encode_image
+
+# Square tile size used to detect unchanged regions between frames
+LIVE_TILE_SIZE = int(os.getenv('LIVE_TILE_SIZE', 32))
+
+# A tile is reused while no pixel drifts more than this many levels from
+# the input its output was computed from (0 = only identical tiles)
+LIVE_TILE_THRESHOLD = int(os.getenv('LIVE_TILE_THRESHOLD', 3))
+
+# Frames larger than this on either side are rejected
+LIVE_MAX_DIMENSION = int(os.getenv('LIVE_MAX_DIMENSION', 1280))
+
+# Concurrent live sessions per process; each one holds a worker thread
+LIVE_MAX_SESSIONS = int(os.getenv('LIVE_MAX_SESSIONS', 4))
+
+# Quality of the JPEG frames sent back
+LIVE_JPEG_QUALITY = int(os.getenv('LIVE_JPEG_QUALITY', 80))
+
+# Largest encoded frame accepted over the socket
+LIVE_MAX_MESSAGE_BYTES = int(os.getenv('LIVE_MAX_MESSAGE_BYTES', 4 * 1024 * 1024))
+
+_session_slots = threading.BoundedSemaphore(LIVE_MAX_SESSIONS)
+
+
+def acquire_session_slot():
+    """Reserve a live session slot. Returns False when all are taken."""
+    return _session_slots.acquire(blocking=False)
+
+
+def release_session_slot():
+    _session_slots.release()
+
+
+class LiveSession:
+    """Per-connection state for live frame correction.
+
+    Keeps the last output and the input each tile of it was computed from.
+    For a new frame only tiles whose input drifted past the threshold are
+    corrected again; the rest are reused from the previous output.
+    """
+
+    def __init__(self, defect="protanopia", intensity=1.0,
+                 tile=LIVE_TILE_SIZE, threshold=LIVE_TILE_THRESHOLD):
+        self.tile = tile
+        self.threshold = threshold
+        self.defect = None
+        self.intensity = None
+        self.configure(defect, intensity)
+
+        self._reference = None  # input each output tile was computed from
+        self._output = None
+        self.frames = 0
+        self.tiles_computed = 0
+        self.tiles_reused = 0
+
+    def configure(self, defect=None, intensity=None):
+        """Change defect and/or intensity. Raises ValueError if invalid."""
+        if defect is not None:
+            if defect not in DEFECTS:
+                raise ValueError(f"Unknown defect: {defect}")
+            self.defect = defect
+        if intensity is not None:
+            self.intensity = float(intensity)
+        self._output = None  # every tile must be recomputed
+
+    def _grid(self, shape):
+        h, w = shape[:2]
+        return -(-h // self.tile), -(-w // self.tile)
+
+    def _changed_tiles(self, frame):
+        """Boolean (tile rows, tile cols) mask of tiles that need recomputing."""
+        diff = cv2.absdiff(frame, self._reference)
+        h, w = diff.shape[:2]
+        rows, cols = self._grid(diff.shape)
+        pad_h, pad_w = rows * self.tile - h, cols * self.tile - w
+        if pad_h or pad_w:
+            diff = cv2.copyMakeBorder(diff, 0, pad_h, 0, pad_w, cv2.BORDER_CONSTANT, value=0)
+        per_tile = diff.reshape(rows, self.tile, cols, self.tile, -1).max(axis=(1, 3, 4))
+        return per_tile > self.threshold
+
+    def process(self, frame):
+        """Correct a uint8 BGR frame, reusing unchanged tiles of the last output.
+
+        The returned array is owned by the session and is overwritten by the
+        next call.
+        """
+        self.frames += 1
+        rows, cols = self._grid(frame.shape)
+
+        if self._output is None or self._output.shape != frame.shape:
+            self._reference = frame.copy()
+            self._output = daltonize(frame, self.defect, self.intensity)
+            self.tiles_computed += rows * cols
+            return self._output
+
+        changed = self._changed_tiles(frame)
+        t = self.tile
+        for ty in np.flatnonzero(changed.any(axis=1)):
+            y0, y1 = ty * t, (ty + 1) * t
+            # Correct each horizontal run of changed tiles as one region
+            row = np.concatenate(([False], changed[ty], [False]))
+            edges = np.flatnonzero(row[1:] != row[:-1])
+            for start, stop in zip(edges[::2], edges[1::2]):
+                x0, x1 = start * t, stop * t
+                region = frame[y0:y1, x0:x1]
+                self._output[y0:y1, x0:x1] = daltonize(region, self.defect, self.intensity)
+                self._reference[y0:y1, x0:x1] = region
+
+        computed = int(changed.sum())
+        self.tiles_computed += computed
+        self.tiles_reused += changed.size - computed
+        return self._output
+
+    def handle_frame(self, data):
+        """Decode an encoded frame, correct it and return it as JPEG bytes.
+
+        Raises ValueError if the frame is invalid or too large.
+        """
+        frame = decode_image(data)
+        if frame is None:
+            raise ValueError("Invalid frame format")
+        if max(frame.shape[:2]) > LIVE_MAX_DIMENSION:
+            raise ValueError(f"Frame too large (max {LIVE_MAX_DIMENSION}px)")
+        encoded = encode_image(self.process(frame), ".jpg",
+                               [cv2.IMWRITE_JPEG_QUALITY, LIVE_JPEG_QUALITY])
+        if encoded is None:
+            raise ValueError("Frame could not be encoded")
+        return encoded.tobytes()
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "tiles_computed": self.tiles_computed,
+            "tiles_reused": self.tiles_reused,
+        }
@@ -0,0 +1,478 @@
+"""End-to-end load test against a local server with MongoDB stubbed by mongomock.
+
+Boots the app in a child process (with its compute workers) against an
+in-memory mongomock database, then drives a weighted mix of /daltonize
+uploads and auth flows at one or more concurrency levels. Reports
+throughput, latency percentiles, error rates and the peak RSS of every
+server and worker process. Needs `pip install mongomock`.
+
+    python loadtest.py --out base.json
+    python loadtest.py --mix upload-vga=3,login=1 --concurrency 1,8 --compare base.json
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+import cv2
+import numpy as np
+
+from benchmark import SIZES, dimensions, synthetic_image
+
+DEFAULT_MIX = "upload-vga=4,upload-1080p=2,upload-12mp=1,login=2,register=1,guest=1"
+
+# Users registered before the run for the login scenario
+LOGIN_USERS = 16
+LOGIN_PASSWORD = "load-test-password"
+
+# Relative change that counts as a regression in --compare mode
+DEFAULT_THRESHOLD = 0.10
+
+# Seconds between RSS samples of the server processes
+SAMPLE_INTERVAL = 0.2
+
+
+# --- Server side ---
+def serve(port):
+    """Run the app on port with mongomock standing in for MongoDB."""
+    try:
+        import mongomock
+    except ImportError:
+        sys.exit("loadtest needs mongomock: pip install mongomock")
+    import database
+    database.use_client(mongomock.MongoClient())
+
+    from werkzeug.serving import make_server
+    from app import app
+    make_server("127.0.0.1", port, app, threaded=True).serve_forever()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port, compute_workers, log_path=None):
+    env = dict(os.environ, COMPUTE_WORKERS=str(compute_workers))
+    log = open(log_path, "w") if log_path else subprocess.DEVNULL
+    server = subprocess.Popen([sys.executable, __file__, "--serve", str(port)],
+                              env=env, stdout=log, stderr=subprocess.STDOUT,
+                              cwd=os.path.dirname(os.path.abspath(__file__)))
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            sys.exit(f"Server exited with code {server.returncode}")
+        try:
+            status, _ = Client(port).request("GET", "/healthz")
+            if status == 200:
+                return server
+        except OSError:
+            pass
+        time.sleep(0.2)
+    server.kill()
+    sys.exit("Server did not become healthy within 60s")
+
+
+# --- Process memory (Linux /proc) ---
+def _children(pid):
+    try:
+        tasks = os.listdir(f"/proc/{pid}/task")
+    except OSError:
+        return []
+    pids = []
+    for tid in tasks:
+        try:
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                pids.extend(int(p) for p in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def _rss_bytes(pid):
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _role(pid, server_pid):
+    if pid == server_pid:
+        return "server"
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            cmdline = f.read()
+    except OSError:
+        return "other"
+    return "compute" if b"spawn_main" in cmdline and b"resource_tracker" not in cmdline else "other"
+
+
+class MemorySampler(threading.Thread):
+    """Samples the RSS of the server and its child processes in the background."""
+
+    def __init__(self, server_pid):
+        super().__init__(daemon=True)
+        self.server_pid = server_pid
+        self.peaks = {}  # pid -> (role, peak RSS bytes)
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(SAMPLE_INTERVAL):
+            for pid in [self.server_pid] + _children(self.server_pid):
+                rss = _rss_bytes(pid)
+                if rss is None:
+                    continue
+                role, peak = self.peaks.get(pid) or (_role(pid, self.server_pid), 0)
+                self.peaks[pid] = (role, max(peak, rss))
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        processes = [{"pid": pid, "role": role, "peak_rss_mb": peak / 1e6}
+                     for pid, (role, peak) in sorted(self.peaks.items())]
+        by_role = {}
+        for p in processes:
+            by_role[p["role"]] = max(by_role.get(p["role"], 0.0), p["peak_rss_mb"])
+        return {"processes": processes, "peak_rss_mb_by_role": by_role}
+
+
+# --- Client side ---
+class Client:
+    """Keep-alive HTTP connection with a cookie jar, one per load thread."""
+
+    def __init__(self, port):
+        self.port = port
+        self.cookies = {}
+        self._conn = None
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if self.cookies:
+            headers["Cookie"] = "; ".join(f"{k}={v}" for k, v in self.cookies.items())
+        for attempt in (0, 1):
+            if self._conn is None:
+                self._conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=300)
+            try:
+                self._conn.request(method, path, body=body, headers=headers)
+                response = self._conn.getresponse()
+                data = response.read()
+                break
+            except (http.client.HTTPException, OSError):
+                self._conn.close()
+                self._conn = None
+                if attempt:
+                    raise
+        for header in response.headers.get_all("Set-Cookie") or ():
+            name, _, value = header.split(";", 1)[0].partition("=")
+            self.cookies[name.strip()] = value
+        return response.status, data
+
+    def post_json(self, path, payload):
+        return self.request("POST", path, json.dumps(payload).encode(),
+                            {"Content-Type": "application/json"})
+
+
+def multipart(fields, files):
+    """Encode form fields and (name, filename, data) files as multipart/form-data."""
+    boundary = uuid.uuid4().hex
+    chunks = []
+    for name, value in fields.items():
+        chunks.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"'
+                      f'\r\n\r\n{value}\r\n'.encode())
+    for name, filename, data in files:
+        chunks.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+                      f'filename="{filename}"\r\nContent-Type: application/octet-stream'
+                      f'\r\n\r\n'.encode())
+        chunks.append(data)
+        chunks.append(b"\r\n")
+    chunks.append(f"--{boundary}--\r\n".encode())
+    return b"".join(chunks), f"multipart/form-data; boundary={boundary}"
+
+
+class Scenarios:
+    """The request flows a mix can draw from. Each returns the status codes
+    it saw and whether they were the expected ones."""
+
+    def __init__(self, sizes, cache_hits=False, output=None):
+        self.cache_hits = cache_hits
+        self.output = output
+        self.uploads = {}
+        for size in sizes:
+            width, height = dimensions(SIZES[size], 4 / 3)
+            jpeg = cv2.imencode(".jpg", synthetic_image(width, height),
+                                [cv2.IMWRITE_JPEG_QUALITY, 90])[1]
+            self.uploads[size] = jpeg.tobytes()
+
+    def names(self):
+        return [f"upload-{size}" for size in self.uploads] + ["register", "login", "guest", "healthz"]
+
+    def setup(self, client):
+        for i in range(LOGIN_USERS):
+            client.post_json("/register", {"username": f"load-user-{i}", "password": LOGIN_PASSWORD})
+
+    def run(self, name, client):
+        if name.startswith("upload-"):
+            return self.upload(client, name[len("upload-"):])
+        return getattr(self, name)(client)
+
+    def upload(self, client, size):
+        data = self.uploads[size]
+        if not self.cache_hits:
+            data += os.urandom(8)  # bytes after the JPEG end marker: new hash, same image
+        fields = {"defect": random.choice(("protanopia", "deuteranopia", "tritanopia"))}
+        if self.output:
+            fields["output"] = self.output
+        body, content_type = multipart(fields, [("image", f"{size}.jpg", data)])
+        status, _ = client.request("POST", "/daltonize", body, {"Content-Type": content_type})
+        return [status], status == 200
+
+    def register(self, client):
+        status, _ = client.post_json("/register", {"username": f"load-{uuid.uuid4().hex}",
+                                                   "password": LOGIN_PASSWORD})
+        return [status], status == 201
+
+    def login(self, client):
+        client.cookies.clear()
+        status, _ = client.post_json("/login", {"username": f"load-user-{random.randrange(LOGIN_USERS)}",
+                                                "password": LOGIN_PASSWORD})
+        if status != 200:
+            return [status], False
+        logout, _ = client.request("POST", "/logout")
+        return [status, logout], logout == 200
+
+    def guest(self, client):
+        client.cookies.clear()
+        status, _ = client.request("POST", "/guest-login")
+        return [status], status == 200
+
+    def healthz(self, client):
+        status, _ = client.request("GET", "/healthz")
+        return [status], status == 200
+
+
+def parse_mix(text, scenarios):
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        if name not in scenarios.names():
+            raise SystemExit(f"Unknown scenario {name!r}, expected one of {', '.join(scenarios.names())}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def run_level(port, scenarios, mix, concurrency, duration, server_pid):
+    """Drive the mix with concurrency threads for duration seconds."""
+    names, weights = list(mix), list(mix.values())
+    samples = {name: [] for name in names}  # (seconds, ok, statuses)
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(seed):
+        rng = random.Random(seed)
+        client = Client(port)
+        while time.monotonic() < deadline:
+            name = rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                statuses, ok = scenarios.run(name, client)
+            except (http.client.HTTPException, OSError):
+                statuses, ok = ["connection"], False
+            seconds = time.perf_counter() - started
+            with lock:
+                samples[name].append((seconds, ok, statuses))
+
+    sampler = MemorySampler(server_pid)
+    sampler.start()
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    memory = sampler.stop()
+
+    results = {}
+    total = errors = 0
+    for name, runs in samples.items():
+        if not runs:
+            continue
+        latencies = np.array([r[0] for r in runs]) * 1000
+        failed = sum(1 for r in runs if not r[1])
+        statuses = Counter(str(s) for r in runs for s in r[2])
+        results[name] = {
+            "count": len(runs),
+            "errors": failed,
+            "error_rate": failed / len(runs),
+            "statuses": dict(statuses),
+            "rps": len(runs) / elapsed,
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p90_ms": float(np.percentile(latencies, 90)),
+            "p99_ms": float(np.percentile(latencies, 99)),
+            "max_ms": float(latencies.max()),
+        }
+        total += len(runs)
+        errors += failed
+    return {
+        "concurrency": concurrency,
+        "seconds": elapsed,
+        "requests": total,
+        "rps": total / elapsed,
+        "error_rate": errors / total if total else 0.0,
+        "scenarios": results,
+        "memory": memory,
+    }
+
+
+def print_level(level):
+    print(f"\nconcurrency {level['concurrency']}: {level['requests']} flows in "
+          f"{level['seconds']:.1f}s, {level['rps']:.1f}/s, {level['error_rate']:.1%} errors")
+    print(f"  {'scenario':<14} {'count':>6} {'/s':>7} {'p50 ms':>8} {'p90 ms':>8} "
+          f"{'p99 ms':>8} {'max ms':>8} {'errors':>7}  statuses")
+    for name, s in level["scenarios"].items():
+        print(f"  {name:<14} {s['count']:>6} {s['rps']:>7.1f} {s['p50_ms']:>8.1f} "
+              f"{s['p90_ms']:>8.1f} {s['p99_ms']:>8.1f} {s['max_ms']:>8.1f} "
+              f"{s['error_rate']:>7.1%}  {s['statuses']}")
+    for p in level["memory"]["processes"]:
+        print(f"  {p['role']:<8} pid {p['pid']:<8} peak RSS {p['peak_rss_mb']:.1f} MB")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return None
+
+
+def compare(current, baseline, threshold):
+    """Print the change against a baseline run. Returns the regressed cases."""
+    base = {level["concurrency"]: level for level in baseline["levels"]}
+    print(f"\nAgainst {baseline['meta'].get('commit') or 'baseline'}:")
+    print(f"{'case':<24} {'/s':>16} {'p99 ms':>18} {'errors':>14}")
+    regressions = []
+    for level in current["levels"]:
+        b_level = base.get(level["concurrency"])
+        if b_level is None:
+            continue
+        for name, s in level["scenarios"].items():
+            b = b_level["scenarios"].get(name)
+            if b is None:
+                continue
+            rps = s["rps"] / max(b["rps"], 1e-9) - 1
+            p99 = s["p99_ms"] / max(b["p99_ms"], 1e-9) - 1
+            errors = s["error_rate"] - b["error_rate"]
+            flags = []
+            if rps < -threshold:
+                flags.append("throughput")
+            if p99 > threshold:
+                flags.append("p99")
+            if errors > 0.01:
+                flags.append("errors")
+            case = f"c{level['concurrency']} {name}"
+            if flags:
+                regressions.append((case, flags))
+            print(f"{case:<24} {s['rps']:>8.1f} ({rps:+.0%}) {s['p99_ms']:>9.1f} ({p99:+.0%}) "
+                  f"{s['error_rate']:>7.1%} ({errors:+.1%})"
+                  f"{'  ⚠️ ' + ', '.join(flags) if flags else ''}")
+
+        b_memory = b_level["memory"]["peak_rss_mb_by_role"]
+        for role, peak in level["memory"]["peak_rss_mb_by_role"].items():
+            b_peak = b_memory.get(role)
+            if b_peak is None:
+                continue
+            # RSS is noisy; ignore changes under 5 MB
+            change = peak / max(b_peak, 1e-9) - 1
+            flagged = change > threshold and peak - b_peak > 5
+            case = f"c{level['concurrency']} {role} RSS"
+            if flagged:
+                regressions.append((case, ["memory"]))
+            print(f"{case:<24} {peak:>8.1f} MB ({change:+.0%}){'  ⚠️ memory' if flagged else ''}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mix", default=DEFAULT_MIX,
+                        help="comma-separated scenario=weight (upload-<size>, register, "
+                             f"login, guest, healthz; sizes: {', '.join(SIZES)})")
+    parser.add_argument("--concurrency", default="1,4,8",
+                        help="comma-separated client thread counts, run one after another")
+    parser.add_argument("--duration", type=float, default=20, help="seconds per concurrency level")
+    parser.add_argument("--compute-workers", type=int, default=1,
+                        help="COMPUTE_WORKERS for the server under test")
+    parser.add_argument("--cache-hits", action="store_true",
+                        help="re-upload identical bytes so /daltonize hits the result cache")
+    parser.add_argument("--output", help="output format to request from /daltonize")
+    parser.add_argument("--server-log", help="write the server's log to this file")
+    parser.add_argument("--out", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="baseline JSON to flag regressions against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="relative change that counts as a regression")
+    parser.add_argument("--serve", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        serve(args.serve)
+        return 0
+
+    sizes = {name.split("-", 1)[1] for name in (i.partition("=")[0] for i in args.mix.split(","))
+             if name.startswith("upload-") and name.split("-", 1)[1] in SIZES}
+    scenarios = Scenarios(sorted(sizes, key=list(SIZES).index), args.cache_hits, args.output)
+    mix = parse_mix(args.mix, scenarios)
+
+    port = free_port()
+    server = start_server(port, args.compute_workers, args.server_log)
+    try:
+        scenarios.setup(Client(port))
+        levels = []
+        for concurrency in (int(c) for c in args.concurrency.split(",")):
+            level = run_level(port, scenarios, mix, concurrency, args.duration, server.pid)
+            print_level(level)
+            levels.append(level)
+    finally:
+        server.terminate()
+        server.wait()
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "mix": mix,
+            "duration": args.duration,
+            "compute_workers": args.compute_workers,
+            "cache_hits": args.cache_hits,
+        },
+        "levels": levels,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"❌ {len(regressions)} regression(s) against {args.compare}")
+            return 1
+        print(f"✅ No regressions against {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,211 @@
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, request
+
+# Seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+MEGAPIXEL_BUCKETS = (0.3, 1, 2, 4, 8, 12, 16, 24, 48)
+BYTE_BUCKETS = tuple(256 * 1024 << n for n in range(12))  # 256 KB .. 512 MB
+RESPONSE_BYTE_BUCKETS = tuple(2 ** n * 1024 for n in range(4, 17))  # 16 KB .. 64 MB
+
+_lock = threading.Lock()
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    pairs = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+                     for k, v in labels)
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name, self.help = name, help_text
+        self.kind = "counter"
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with _lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    def __init__(self, name, help_text, callback=None):
+        super().__init__(name, help_text)
+        self.kind = "gauge"
+        self._callback = callback  # returns {labels tuple: value} at scrape time
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            self._values[key] = value
+
+    def samples(self):
+        if self._callback is not None:
+            return [(self.name, key, value) for key, value in self._callback().items()]
+        return super().samples()
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name, self.help = name, help_text
+        self.kind = "histogram"
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            state = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def samples(self):
+        out = []
+        with _lock:
+            for key, state in self._values.items():
+                for bound, count in zip(self.buckets, state):
+                    out.append((f"{self.name}_bucket", key + (("le", _value_text(bound)),), count))
+                out.append((f"{self.name}_bucket", key + (("le", "+Inf"),), state[-1]))
+                out.append((f"{self.name}_sum", key, state[-2]))
+                out.append((f"{self.name}_count", key, state[-1]))
+        return out
+
+
+# Metrics live in this process only. Under gunicorn with several workers a
+# scrape of /metrics sees whichever worker answered, so counters jump
+# between workers' values; scrape each worker (or run one) for totals.
+REGISTRY = []
+
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+REQUEST_SECONDS = register(Histogram(
+    "colaid_request_seconds", "Request latency by route"))
+REQUESTS_TOTAL = register(Counter(
+    "colaid_requests_total", "Requests by route and status"))
+REQUESTS_IN_FLIGHT = register(Gauge(
+    "colaid_requests_in_flight", "Requests being served by route"))
+STAGE_SECONDS = register(Histogram(
+    "colaid_stage_seconds", "Time per request stage (upload, decode, color math, encode, mongo, ...)"))
+UPLOAD_BYTES = register(Histogram(
+    "colaid_upload_bytes", "Uploaded image size", BYTE_BUCKETS))
+IMAGE_MEGAPIXELS = register(Histogram(
+    "colaid_image_megapixels", "Decoded image size", MEGAPIXEL_BUCKETS))
+ENCODE_SECONDS = register(Histogram(
+    "colaid_encode_seconds", "Output image encode time by format"))
+ENCODED_BYTES = register(Histogram(
+    "colaid_encoded_bytes", "Output image size by format", RESPONSE_BYTE_BUCKETS))
+JOB_PEAK_RSS_BYTES = register(Histogram(
+    "colaid_job_peak_rss_bytes", "Worker RSS while an image job holds all its outputs", BYTE_BUCKETS))
+
+
+def _value_text(value):
+    # Exact: "%g" keeps only 6 significant digits
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+def render():
+    """All registered metrics in Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{_label_text(labels)} {_value_text(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def current_rss_bytes():
+    """Resident set size of this process (peak RSS where /proc isn't available)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+# --- Per-request stage timings (also sent as Server-Timing) ---
+def record_stage(name, seconds, timings=None):
+    """Add a stage duration to the request's timings and the stage histogram.
+
+    timings defaults to the current Flask request's; code outside Flask
+    (auth_async.py) passes its own dict.
+    """
+    STAGE_SECONDS.observe(seconds, stage=name)
+    if timings is None:
+        timings = g.setdefault("stage_timings", {})
+    timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def stage(name, timings=None):
+    """Time a block as one request stage."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started, timings)
+
+
+def server_timing(total_seconds, timings=None):
+    """Server-Timing header value for a request's stages (default: the current one)."""
+    if timings is None:
+        timings = g.get("stage_timings", {})
+    parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items()]
+    parts.append(f"total;dur={total_seconds * 1000:.1f}")
+    return ", ".join(parts)
+
+
+def _route():
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+
+def init_app(app):
+    """Time every request of app and log one JSON line per request."""
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+        g.route = _route()
+        REQUESTS_IN_FLIGHT.inc(route=g.route)
+
+    @app.after_request
+    def add_server_timing(response):
+        if "request_started" not in g:
+            return response
+        total = time.perf_counter() - g.request_started
+        response.headers["Server-Timing"] = server_timing(total)
+        REQUEST_SECONDS.observe(total, route=g.route)
+        REQUESTS_TOTAL.inc(route=g.route, status=response.status_code)
+        print(json.dumps({"route": g.route, "status": response.status_code,
+                          "ms": round(total * 1000, 1),
+                          "stages": {k: round(v * 1000, 1) for k, v in g.get("stage_timings", {}).items()}}))
+        return response
+
+    @app.teardown_request
+    def end_request(exc):
+        if "route" in g:
+            REQUESTS_IN_FLIGHT.dec(route=g.route)
@@ -1,7 +1,19 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from bson import ObjectId
 
+# Password hashing runs off the request thread, on a dedicated pool (the
+# KDF releases the GIL). It is one thread short of the core count, so a
+# burst of logins queues here instead of taking every core from the other
+# requests; raising PASSWORD_HASH_WORKERS trades that headroom for login
+# throughput. The async auth server awaits the same pool.
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', max(1, (os.cpu_count() or 1) - 1)))
+_hash_pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS,
+                                thread_name_prefix='password-hash')
+
 class User(UserMixin):
     def __init__(self, user_data):
         self._id = user_data.get('_id')
@@ -12,10 +24,23 @@ class User(UserMixin):
         return str(self._id)
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = _hash_pool.submit(generate_password_hash, password).result()
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        if not self.password_hash:
+            return False
+        return _hash_pool.submit(check_password_hash, self.password_hash, password).result()
+
+    async def set_password_async(self, password):
+        """set_password for coroutines: awaits the hash pool instead of blocking."""
+        self.password_hash = await asyncio.wrap_future(
+            _hash_pool.submit(generate_password_hash, password))
+
+    async def check_password_async(self, password):
+        if not self.password_hash:
+            return False
+        return await asyncio.wrap_future(
+            _hash_pool.submit(check_password_hash, self.password_hash, password))
     
     def to_dict(self):
         return {
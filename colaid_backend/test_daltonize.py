@@ -0,0 +1,77 @@
+"""Regression checks for the table-driven daltonize kernel.
+
+Pins what the kernel promises: output within 1 level of the per-pixel
+gamma formulas for every RGB color, and bit-identical output whatever the
+strip height. Run with pytest, or directly: python test_daltonize.py
+"""
+import numpy as np
+
+from daltonize import (DEFECTS, CORRECTION_GAIN, daltonize, daltonize_variants,
+                       linearize, delinearize)
+
+INTENSITIES = (1.0, 0.5)
+
+
+def formula_daltonize(image_bgr, defect, intensity=1.0):
+    """The original formula path: per-pixel gamma, simulate, shift, clip."""
+    sim, shift = DEFECTS[defect]
+    img = linearize(image_bgr[..., ::-1].astype(np.float32))
+    error = img - img @ sim.T
+    out = img + (error @ shift.T) * (CORRECTION_GAIN * intensity)
+    np.clip(out, 0, 1, out=out)
+    return (delinearize(out) * 255).astype(np.uint8)[..., ::-1]
+
+
+def rgb_sweep(rows_per_chunk=256):
+    """Every 24-bit color as a 4096×4096 BGR image, yielded in row chunks."""
+    codes = np.arange(1 << 24, dtype=np.uint32).reshape(4096, 4096)
+    for y in range(0, 4096, rows_per_chunk):
+        chunk = codes[y:y + rows_per_chunk]
+        yield np.stack([chunk & 0xFF, (chunk >> 8) & 0xFF, chunk >> 16],
+                       axis=-1).astype(np.uint8)
+
+
+def random_image(height=97, width=131, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+
+def test_within_one_level_of_formula_for_every_color():
+    for defect in DEFECTS:
+        for intensity in INTENSITIES:
+            worst = 0
+            for chunk in rgb_sweep():
+                diff = np.abs(daltonize(chunk, defect, intensity).astype(np.int16) -
+                              formula_daltonize(chunk, defect, intensity))
+                worst = max(worst, int(diff.max()))
+            assert worst <= 1, f"{defect} x{intensity}: off by {worst} levels"
+
+
+def test_output_identical_for_any_strip_height():
+    image = random_image()
+    for defect in DEFECTS:
+        expected = daltonize(image, defect)
+        # 1 byte forces one-row strips; the others split rows unevenly
+        for budget in (1, 5000, 40000, 1 << 20):
+            assert np.array_equal(daltonize(image, defect, memory_budget=budget), expected), \
+                f"{defect}: output changed at a {budget}-byte strip budget"
+
+
+def test_variants_match_single_calls():
+    image = random_image(seed=1)
+    variants = [(defect, intensity) for defect in DEFECTS for intensity in INTENSITIES]
+    for budget in (1, None):
+        outputs = daltonize_variants(image, variants, memory_budget=budget)
+        for (defect, intensity), out in zip(variants, outputs):
+            assert np.array_equal(out, daltonize(image, defect, intensity))
+
+
+def test_unknown_defect_returns_image_unchanged():
+    image = random_image(seed=2)
+    assert np.array_equal(daltonize(image, "bogus"), image)
+
+
+if __name__ == "__main__":
+    for name, check in list(globals().items()):
+        if name.startswith("test_"):
+            check()
+            print(f"✅ {name}")
@@ -0,0 +1,350 @@
+import collections
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import wait
+
+import cv2
+
+from compute import engine, COMPUTE_TIMEOUT
+from daltonize import daltonize, DEFECTS, STRIP_MEMORY_BUDGET
+
+# Frames buffered between pipeline stages, and frames out on the compute
+# pool at once. Memory per job stays at about (4 * VIDEO_QUEUE_FRAMES + 3)
+# frames whatever the clip length (see video_memory).
+VIDEO_QUEUE_FRAMES = int(os.getenv('VIDEO_QUEUE_FRAMES', 4))
+
+# Concurrent video jobs per process; each one holds three threads
+VIDEO_MAX_JOBS = int(os.getenv('VIDEO_MAX_JOBS', 2))
+
+# Clips with frames larger than this on either side are rejected
+VIDEO_MAX_DIMENSION = int(os.getenv('VIDEO_MAX_DIMENSION', 1920))
+
+# Clips with more frames than this are rejected (5 minutes at 30 fps)
+VIDEO_MAX_FRAMES = int(os.getenv('VIDEO_MAX_FRAMES', 9000))
+
+# Seconds a finished job and its output are kept for download
+VIDEO_RESULT_TTL = int(os.getenv('VIDEO_RESULT_TTL', 600))
+
+# Output codec; MPEG-4 Part 2 is available in every OpenCV FFmpeg build
+VIDEO_FOURCC = os.getenv('VIDEO_FOURCC', 'mp4v')
+
+# Used when the container doesn't report a frame rate
+DEFAULT_VIDEO_FPS = 30.0
+
+# How often blocked pipeline threads check for cancellation, in seconds
+_POLL_SECONDS = 0.1
+
+_END = object()
+
+
+class VideoCancelled(Exception):
+    """The job was cancelled while its pipeline was running."""
+
+
+class _Failure:
+    """An exception raised by a producer, handed to the consumer to re-raise."""
+
+    def __init__(self, error):
+        self.error = error
+
+
+def pipelined(items, stop, maxsize=VIDEO_QUEUE_FRAMES):
+    """Run the iterable items on its own thread, yielding through a bounded queue.
+
+    The producer blocks once maxsize items are waiting, so a fast stage
+    never runs more than maxsize items ahead of a slow one. Exceptions
+    raised by items are re-raised in the consumer. Setting stop makes both
+    sides give up (the consumer with VideoCancelled); so does the consumer
+    closing the generator early.
+    """
+    buffer = queue.Queue(maxsize)
+    closed = threading.Event()
+
+    def put(item):
+        while not (stop.is_set() or closed.is_set()):
+            try:
+                buffer.put(item, timeout=_POLL_SECONDS)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put(item):
+                    return
+            put(_END)
+        except Exception as e:
+            put(_Failure(e))
+        finally:
+            if hasattr(items, "close"):
+                items.close()  # lets an upstream stage stop its own thread
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            try:
+                item = buffer.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                if stop.is_set():
+                    raise VideoCancelled()
+                continue
+            if item is _END:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        closed.set()
+        thread.join()
+
+
+def video_memory(width, height):
+    """Estimated peak bytes of a job's frames: both stage queues, the frames
+    the stage threads hold, and the frames out on the pool with their
+    corrected copies."""
+    return width * height * 3 * (4 * VIDEO_QUEUE_FRAMES + 3) + STRIP_MEMORY_BUDGET
+
+
+def probe(path):
+    """Open a clip and return (width, height, fps, frame count).
+
+    Raises ValueError if it can't be read or is over the size limits.
+    """
+    capture = cv2.VideoCapture(path)
+    try:
+        if not capture.isOpened():
+            raise ValueError("Invalid video format")
+        width = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    finally:
+        capture.release()
+    if width <= 0 or height <= 0:
+        raise ValueError("Invalid video format")
+    if max(width, height) > VIDEO_MAX_DIMENSION:
+        raise ValueError(f"Video frames too large (max {VIDEO_MAX_DIMENSION}px)")
+    if frames > VIDEO_MAX_FRAMES:
+        raise ValueError(f"Video too long (max {VIDEO_MAX_FRAMES} frames)")
+    # Some containers report 0 or nonsense; fall back to a common rate
+    if not 1 <= fps <= 240:
+        fps = DEFAULT_VIDEO_FPS
+    return width, height, fps, max(frames, 0)
+
+
+class VideoJob:
+    """One clip going through decode → daltonize → encode.
+
+    Decoding and correction each run on their own thread, feeding the next
+    stage through a bounded queue; encoding runs on the job's thread. Frames
+    are corrected on the compute engine's pool, so the color math shares
+    its CPU and memory budget with image requests. The output keeps the
+    source frame rate and size (audio is dropped).
+    """
+
+    def __init__(self, source, workdir, defect="protanopia", intensity=1.0):
+        if defect not in DEFECTS:
+            raise ValueError(f"Unknown defect: {defect}")
+        self.id = uuid.uuid4().hex
+        self.source = source
+        self.workdir = workdir
+        self.output = os.path.join(workdir, "output.mp4")
+        self.defect = defect
+        self.intensity = float(intensity)
+        self.width, self.height, self.fps, self.total_frames = probe(source)
+        self.memory = video_memory(self.width, self.height)
+
+        self.state = "queued"  # queued, running, done, failed, cancelled
+        self.error = None
+        self.frames = 0
+        self.stage_seconds = {"decode": 0.0, "correct": 0.0, "encode": 0.0}
+        self.started = None
+        self.finished = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _decode(self):
+        capture = cv2.VideoCapture(self.source)
+        try:
+            while True:
+                started = time.perf_counter()
+                ok, frame = capture.read()
+                self.stage_seconds["decode"] += time.perf_counter() - started
+                if not ok:
+                    return
+                yield frame
+        finally:
+            capture.release()
+
+    def _correct(self, frames):
+        # Up to VIDEO_QUEUE_FRAMES frames are out on the pool at once, so
+        # every compute worker stays busy; results come back in order
+        pending = collections.deque()
+        try:
+            for frame in frames:
+                pending.append(engine.submit(daltonize, frame, self.defect, self.intensity))
+                if len(pending) >= VIDEO_QUEUE_FRAMES:
+                    yield self._corrected(pending.popleft())
+            while pending:
+                yield self._corrected(pending.popleft())
+        finally:
+            # Frames already running keep their memory until they finish,
+            # so wait for them before the job releases its reservation
+            for future in pending:
+                future.cancel()
+            wait(pending, COMPUTE_TIMEOUT)
+
+    def _corrected(self, future):
+        started = time.perf_counter()
+        corrected = future.result(COMPUTE_TIMEOUT)
+        self.stage_seconds["correct"] += time.perf_counter() - started
+        return corrected
+
+    def run(self):
+        self.state = "running"
+        self.started = time.monotonic()
+        writer = cv2.VideoWriter(self.output, cv2.VideoWriter_fourcc(*VIDEO_FOURCC),
+                                 self.fps, (self.width, self.height))
+        try:
+            if not writer.isOpened():
+                raise RuntimeError(f"Could not open a {VIDEO_FOURCC} video writer")
+            frames = pipelined(self._decode(), self._stop)
+            for frame in pipelined(self._correct(frames), self._stop):
+                if frame.shape[:2] != (self.height, self.width):
+                    raise ValueError("Video changes frame size midway")
+                started = time.perf_counter()
+                writer.write(frame)
+                self.stage_seconds["encode"] += time.perf_counter() - started
+                self.frames += 1
+                if self.frames > VIDEO_MAX_FRAMES:
+                    raise ValueError(f"Video too long (max {VIDEO_MAX_FRAMES} frames)")
+            if self.frames == 0:
+                raise ValueError("Video has no readable frames")
+            self.state = "done"
+        except VideoCancelled:
+            self.state = "cancelled"
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+            print(f"❌ Video job {self.id} failed: {e}")
+        finally:
+            writer.release()
+            self._stop.set()
+            engine.release(self.memory)
+            self.finished = time.monotonic()
+            if self.state != "done":
+                shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name=f"video-{self.id[:8]}", daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        """Stop the pipeline; the job ends as cancelled unless already finished."""
+        self._stop.set()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def active(self):
+        return self.state in ("queued", "running")
+
+    def progress(self):
+        elapsed = ((self.finished or time.monotonic()) - self.started) if self.started else 0.0
+        return {
+            "id": self.id,
+            "state": self.state,
+            "error": self.error,
+            "defect": self.defect,
+            "intensity": self.intensity,
+            "width": self.width,
+            "height": self.height,
+            "fps": self.fps,
+            "frames": self.frames,
+            "total_frames": self.total_frames or None,
+            "progress": min(1.0, self.frames / self.total_frames) if self.total_frames else None,
+            "elapsed_seconds": round(elapsed, 3),
+            # Throughput of the whole pipeline, and time per stage (for
+            # correct, the time spent waiting on the pool)
+            "processing_fps": round(self.frames / elapsed, 2) if elapsed else None,
+            "stage_seconds": {k: round(v, 3) for k, v in self.stage_seconds.items()},
+        }
+
+
+# Jobs live in this process's memory, like the compute engine. Under
+# gunicorn with several workers, the status and result requests for a job
+# must reach the worker that started it: run one worker for the video
+# routes or route them stickily (e.g. by client address).
+_jobs = {}
+_jobs_lock = threading.Lock()
+_reserved = 0  # slots held by uploads still being saved and probed
+
+
+def _expire_jobs(now):
+    for job_id, job in list(_jobs.items()):
+        if not job.active() and now - job.finished > VIDEO_RESULT_TTL:
+            del _jobs[job_id]
+            shutil.rmtree(job.workdir, ignore_errors=True)
+
+
+def start_job(upload, defect="protanopia", intensity=1.0):
+    """Save an uploaded clip and start correcting it in the background.
+
+    upload is a werkzeug FileStorage. Returns the running VideoJob, or None
+    when VIDEO_MAX_JOBS are already running. Raises ValueError if the clip
+    or parameters are invalid, and JobTooLarge or ComputeSaturated if the
+    compute engine can't reserve the job's frame memory.
+    """
+    global _reserved
+    # Reserve a slot, then save and probe without holding the lock, so a
+    # slow upload doesn't stall progress polls or other uploads
+    with _jobs_lock:
+        _expire_jobs(time.monotonic())
+        if sum(job.active() for job in _jobs.values()) + _reserved >= VIDEO_MAX_JOBS:
+            return None
+        _reserved += 1
+
+    job = None
+    # VideoCapture needs a path, so the clip is written out
+    workdir = tempfile.mkdtemp(prefix="colaid-video-")
+    try:
+        source = os.path.join(workdir, "source")
+        upload.save(source)
+        job = VideoJob(source, workdir, defect, intensity)
+        # Held until the job ends (VideoJob.run releases it)
+        engine.reserve(job.memory)
+    except Exception:
+        job = None
+        raise
+    finally:
+        with _jobs_lock:
+            _reserved -= 1
+            if job is not None:
+                _jobs[job.id] = job
+        if job is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+    job.start()
+    return job
+
+
+def get_job(job_id):
+    with _jobs_lock:
+        _expire_jobs(time.monotonic())
+        return _jobs.get(job_id)
+
+
+def job_counts():
+    """Jobs held per state, for metrics."""
+    with _jobs_lock:
+        counts = {}
+        for job in _jobs.values():
+            counts[job.state] = counts.get(job.state, 0) + 1
+        return counts